@@ -0,0 +1,169 @@
+import re
+import json
+import time
+import random
+import threading
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT_RE = re.compile(r'^/(?P<hc>[^/]+)/api/v2/help_center(?P<path>/.*)$')
+ARTICLE_RE = re.compile(r'^/articles/(\d+)\.json$')
+MISSING_RE = re.compile(r'^/articles/(\d+)/translations/missing\.json$')
+TRANSLATIONS_RE = re.compile(r'^/articles/(\d+)/translations\.json$')
+TRANSLATION_RE = re.compile(r'^/articles/(\d+)/translations/([\w-]+)\.json$')
+
+
+class FakeHelpCenter:
+    """
+    Local stand-in for the Help Center API endpoints used by zlo, served at
+    http://127.0.0.1:{port}/{hc}/api/v2/help_center. Adds latency to each request and answers some with 429.
+    """
+
+    def __init__(self, latency=0.0, page_size=100, rate_429=0.0, retry_after=0, seed=0):
+        """
+        :param latency: Seconds to wait before answering each request
+        :param page_size: Number of articles in each page of the incremental export
+        :param rate_429: Fraction of requests answered with 429 Too Many Requests, from 0 to 1
+        :param retry_after: Value of the Retry-After header of 429 responses, in seconds
+        :param seed: Seed of the random 429s, so runs are repeatable
+        """
+        self.latency = latency
+        self.page_size = page_size
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.articles = {}          # {(hc, id): article}
+        self.translations = {}      # {(hc, id): {locale: translation}}
+        self.locales = set()
+        self.counts = Counter()
+        self.server = None
+        self.thread = None
+
+    def add_article(self, hc, article):
+        with self.lock:
+            self.articles[(hc, article['id'])] = article
+            self.translations.setdefault((hc, article['id']), {})
+
+    def start(self):
+        """
+        Starts serving in a background thread on a free port.
+        :return: Root url template, with a {hc} placeholder
+        """
+        help_center = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                help_center.handle(self, 'GET')
+
+            def do_PUT(self):
+                help_center.handle(self, 'PUT')
+
+            def do_POST(self):
+                help_center.handle(self, 'POST')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return 'http://127.0.0.1:{}/{{hc}}/api/v2/help_center'.format(self.server.server_port)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_counts(self):
+        with self.lock:
+            return Counter(self.counts)
+
+    def handle(self, request, method):
+        length = int(request.headers.get('Content-Length') or 0)
+        payload = json.loads(request.rfile.read(length)) if length else None
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(request.path)
+        match = ROOT_RE.match(url.path)
+        with self.lock:
+            self.counts['requests'] += 1
+            if self.rate_429 and self.random.random() < self.rate_429:
+                self.counts['429'] += 1
+                return self.respond(request, 429, {'error': 'TooManyRequests'},
+                                    {'Retry-After': str(self.retry_after)})
+            if match is None:
+                return self.respond(request, 404, {'error': 'RecordNotFound'})
+            status, data = self.route(method, match.group('hc'), match.group('path'), parse_qs(url.query), payload,
+                                      request)
+            self.counts['{} {}'.format(method, get_endpoint(match.group('path')))] += 1
+        self.respond(request, status, data)
+
+    def route(self, method, hc, path, query, payload, request):
+        """
+        Answers a request. Called with the lock held.
+        :return: Tuple of the status code and the JSON data of the response
+        """
+        if method == 'GET' and path == '/incremental/articles.json':
+            start_time = int(query.get('start_time', ['0'])[0])
+            articles = sorted((a for (a_hc, _), a in self.articles.items()
+                               if a_hc == hc and a['_timestamp'] >= start_time), key=lambda a: a['_timestamp'])
+            page = articles[:self.page_size]
+            end_time = page[-1]['_timestamp'] + 1 if page else start_time
+            next_page = 'http://{}/{}/api/v2/help_center/incremental/articles.json?start_time={}'.format(
+                request.headers['Host'], hc, end_time)
+            return 200, {'articles': [export(a) for a in page], 'next_page': next_page, 'end_time': end_time,
+                         'count': len(page)}
+        match = ARTICLE_RE.match(path)
+        if method == 'GET' and match:
+            article = self.articles.get((hc, int(match.group(1))))
+            return (200, {'article': export(article)}) if article else (404, {'error': 'RecordNotFound'})
+        match = MISSING_RE.match(path)
+        if method == 'GET' and match:
+            done = self.translations.get((hc, int(match.group(1))), {})
+            return 200, {'locales': sorted(self.locales - set(done))}
+        match = TRANSLATIONS_RE.match(path)
+        if method == 'POST' and match:
+            key = (hc, int(match.group(1)))
+            locale = payload['translation']['locale']
+            if key not in self.translations or locale in self.translations[key]:
+                return 400, {'error': 'InvalidRecord'}
+            self.translations[key][locale] = dict(payload['translation'], source_id=key[1])
+            return 201, {'translation': self.translations[key][locale]}
+        match = TRANSLATION_RE.match(path)
+        if method in ('GET', 'PUT') and match:
+            key = (hc, int(match.group(1)))
+            if match.group(2) not in self.translations.get(key, {}):
+                return 404, {'error': 'RecordNotFound'}
+            if method == 'PUT':
+                self.translations[key][match.group(2)] = dict(payload['translation'], locale=match.group(2),
+                                                              source_id=key[1])
+            return 200, {'translation': self.translations[key][match.group(2)]}
+        return 404, {'error': 'RecordNotFound'}
+
+    @staticmethod
+    def respond(request, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+
+def export(article):
+    return {k: v for k, v in article.items() if not k.startswith('_')}
+
+
+def get_endpoint(path):
+    """
+    :param path: Path after the API root, such as '/articles/123/translations/de.json'
+    :return: Path with the ids and locales replaced, such as '/articles/{id}/translations/{locale}.json'
+    """
+    path = re.sub(r'/\d+', '/{id}', path)
+    return re.sub(r'/translations/(?!missing)[\w-]+\.json$', '/translations/{locale}.json', path)
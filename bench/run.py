@@ -0,0 +1,244 @@
+"""
+Measures the throughput of zlo.py create and publish against local stand-ins for Help Center and S3.
+
+    $ python3 bench/run.py --articles 200 --locales 5 --images 3 --latency 0.02 --rate-429 0.01
+
+Requires moto[server] for the S3 stand-in. Nothing is sent to Zendesk or Amazon.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import socket
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench.fake_hc import FakeHelpCenter    # noqa: E402
+
+ZLO = Path(__file__).resolve().parents[1] / 'zlo.py'
+BUCKET = 'zen-marketing-documentation'
+LOCALES = ['de', 'fr', 'ja', 'es', 'pt-br', 'it', 'ko', 'zh-cn', 'nl', 'ru']
+HC = 'support'
+HANDOFF = 'bench'
+
+SETTINGS = '''[PATHS]
+handoffs={workdir}/handoffs/
+data={workdir}/data/
+
+[AWS]
+bucket_name={bucket}
+key_prefix=docs/en/
+locales={locales}
+endpoint_url={s3_url}
+upload_workers=8
+multipart_threshold_mb=8
+multipart_chunksize_mb=8
+max_concurrency=4
+
+[HTTP]
+hc_root={hc_root}
+download_workers=8
+requests_per_second=1000
+burst=100
+pool_connections=10
+pool_maxsize=16
+max_retries=5
+backoff_factor=0.1
+max_backoff=2
+timeout=60
+
+[MIRROR]
+enabled=yes
+path={workdir}/article_mirror.db
+
+[CACHE]
+enabled=yes
+path={workdir}/image_cache
+max_size_mb=512
+
+[PUBLISH]
+parse_workers=0
+in_flight=32
+upload_workers=4
+
+[PACKAGE]
+compress_workers=4
+
+[WATCH]
+settle_seconds=5
+poll_seconds=1
+
+[HTML]
+engine=lxml
+'''
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def get_article_body(article_id, images, article_ids):
+    paragraphs = []
+    for i in range(20):
+        link = article_ids[(article_ids.index(article_id) + i + 1) % len(article_ids)]
+        paragraphs.append('<p>Paragraph {} of the article. See <a href="/hc/en-us/articles/{}">the next one</a> '
+                          'for <strong>details</strong>.</p>'.format(i, link))
+    for image in images:
+        paragraphs.append('<p><img src="https://{}.s3.amazonaws.com/docs/en/{}" alt="{}"></p>'.format(
+            BUCKET, image, image))
+    return '\n'.join(paragraphs)
+
+
+def seed(workdir, help_center, bucket, articles, images):
+    """
+    Creates the synthetic articles in the fake Help Center, their images in the S3 stand-in, and the handoff manifest.
+    """
+    from modules.store import Store
+    article_ids = [360000000000 + i for i in range(articles)]
+    manifest = []
+    for n, article_id in enumerate(article_ids):
+        names = ['bench-{}-{}.png'.format(article_id, k) for k in range(images)]
+        for name in names:
+            bucket.put_object(Key='docs/en/' + name, Body=os.urandom(20 * 1024))
+        help_center.add_article(HC, {'id': article_id, 'section_id': 1, 'locale': 'en-us', 'draft': False,
+                                     'title': 'Benchmark article {}'.format(n),
+                                     'updated_at': '2020-01-01T00:00:00Z', '_timestamp': 1000 + n,
+                                     'body': get_article_body(article_id, names, article_ids)})
+        manifest.append({'id': article_id, 'deferred_id': None, 'hc': HC, 'title': 'Benchmark article {}'.format(n),
+                         'en_images': False, 'bump_ok': False, 'writer': None, 'comments': None})
+    Store(workdir / 'data' / 'zlo.db').save_handoff(HANDOFF, manifest)
+
+
+def translate(workdir, locales):
+    """
+    Copies the handoff into a translations folder for each locale, as the vendor returns it.
+    """
+    handoff_path = workdir / 'handoffs' / HANDOFF
+    for locale in locales:
+        target = handoff_path / 'translations' / locale / HC
+        for folder in ('articles', 'images'):
+            if (handoff_path / HC / folder).exists():
+                shutil.copytree(handoff_path / HC / folder, target / folder)
+
+
+def run(workdir, help_center, arguments, env, verbose):
+    """
+    Runs a zlo.py subcommand and measures it.
+    :return: Dict of the elapsed seconds, peak RSS in MB, exit code, and Help Center requests
+    """
+    before = help_center.get_counts()
+    start = time.perf_counter()
+    output = None if verbose else subprocess.DEVNULL
+    process = subprocess.Popen([sys.executable, str(ZLO)] + arguments, cwd=str(workdir), env=env,
+                               stdout=output, stderr=output)
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    else:
+        process.wait()
+        rss = None
+    elapsed = time.perf_counter() - start
+    counts = help_center.get_counts()
+    counts.subtract(before)
+    return {'seconds': round(elapsed, 3), 'peak_rss_mb': round(rss, 1) if rss is not None else None,
+            'exit_code': process.returncode, 'requests': {k: v for k, v in sorted(counts.items()) if v}}
+
+
+def print_report(results):
+    print('\n{:<10} {:>9} {:>11} {:>10} {:>6} {:>13}'.format('command', 'seconds', 'articles/s', 'requests',
+                                                             '429s', 'peak RSS (MB)'))
+    for name, result in results.items():
+        print('{:<10} {:>9.2f} {:>11.1f} {:>10} {:>6} {:>13}'.format(
+            name, result['seconds'], result['articles_per_second'], result['requests'].get('requests', 0),
+            result['requests'].get('429', 0), result['peak_rss_mb']))
+    for name, result in results.items():
+        print('\n{} requests:'.format(name))
+        for endpoint, count in result['requests'].items():
+            if endpoint not in ('requests', '429'):
+                print('- {}: {}'.format(endpoint, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark zlo.py create and publish offline')
+    parser.add_argument('--articles', type=int, default=100, help='number of articles in the handoff')
+    parser.add_argument('--locales', type=int, default=3, help='number of locales in the deliverable (max 10)')
+    parser.add_argument('--images', type=int, default=2, help='number of images in each article')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the fake Help Center waits per request')
+    parser.add_argument('--page-size', type=int, default=100, help='articles per page of the incremental export')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=0, help='Retry-After of the 429 responses, in seconds')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--keep', action='store_true', help='keep the working folder')
+    parser.add_argument('--verbose', action='store_true', help='show the output of zlo.py')
+    parser.add_argument('--metrics', action='store_true', help='write the zlo.py metrics reports to the handoff folder')
+    arguments = parser.parse_args()
+
+    try:
+        import boto3
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        print('The benchmark needs moto[server]: pip install "moto[server]". Exiting.')
+        exit()
+
+    workdir = Path(tempfile.mkdtemp(prefix='zlo-bench-'))
+    (workdir / 'handoffs').mkdir()
+    (workdir / 'data').mkdir()
+    (workdir / 'data' / 'image_skip_list.txt').write_text('')
+    env = dict(os.environ, AWS_ACCESS_KEY_ID='bench', AWS_SECRET_ACCESS_KEY='bench', AWS_DEFAULT_REGION='us-east-1',
+               ZEN_USER='bench@example.com', ZEN_API_TOKEN='bench')
+
+    locales = LOCALES[:arguments.locales]
+    help_center = FakeHelpCenter(arguments.latency, arguments.page_size, arguments.rate_429, arguments.retry_after)
+    help_center.locales = set(locales)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)    # request log of the S3 stand-in
+    s3_port = get_free_port()
+    s3_server = ThreadedMotoServer(ip_address='127.0.0.1', port=s3_port, verbose=False)
+    s3_server.start()
+    try:
+        s3_url = 'http://127.0.0.1:{}'.format(s3_port)
+        hc_root = help_center.start()
+        (workdir / 'settings.ini').write_text(SETTINGS.format(workdir=workdir, bucket=BUCKET, s3_url=s3_url,
+                                                              hc_root=hc_root, locales=','.join(locales)))
+        bucket = boto3.resource('s3', endpoint_url=s3_url, aws_access_key_id='bench',
+                                aws_secret_access_key='bench', region_name='us-east-1').Bucket(BUCKET)
+        bucket.create()
+        print('Seeding {} articles with {} images each in {}'.format(arguments.articles, arguments.images, workdir))
+        seed(workdir, help_center, bucket, arguments.articles, arguments.images)
+
+        results = {}
+        print('Running create')
+        extra = ['--metrics'] if arguments.metrics else []
+        results['create'] = run(workdir, help_center, ['create', HANDOFF] + extra, env, arguments.verbose)
+        results['create']['articles_per_second'] = arguments.articles / results['create']['seconds']
+        translate(workdir, locales)
+        print('Running publish')
+        results['publish'] = run(workdir, help_center, ['publish', HANDOFF] + extra, env, arguments.verbose)
+        results['publish']['articles_per_second'] = arguments.articles * len(locales) / results['publish']['seconds']
+
+        print_report(results)
+        for name, result in results.items():
+            if result['exit_code'] != 0:
+                print('\n{} exited with code {}. Run with --verbose for details.'.format(name, result['exit_code']))
+        if arguments.output:
+            Path(arguments.output).write_text(json.dumps({'parameters': vars(arguments), 'results': results},
+                                                         indent=2))
+    finally:
+        help_center.stop()
+        s3_server.stop()
+        if arguments.keep:
+            print('\nWorking folder: {}'.format(workdir))
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
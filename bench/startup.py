@@ -0,0 +1,123 @@
+"""
+Measures the startup time and peak memory of zlo.py subcommands, and checks that the commands that don't need them
+don't load the heavy dependencies.
+
+    $ python3 bench/startup.py --repeat 5
+
+Runs offline in a temporary folder. Exits with status 1 if a command loads a module it shouldn't.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+ZLO = ROOT / 'zlo.py'
+HANDOFF = 'startup'
+HEAVY_MODULES = ['boto3', 'botocore', 's3transfer', 'bs4', 'lxml', 'arrow', 'requests']
+
+# Name, zlo.py arguments, and heavy modules the command is allowed to load. The create and publish cases stop at
+# their first check, before any work, so they measure what every run of the command pays before starting
+CASES = [('--help', ['--help'], []),
+         ('--version', ['--version'], []),
+         ('migrate', ['migrate'], []),
+         ('load', ['load', HANDOFF], ['requests']),
+         ('create', ['create', HANDOFF], ['requests']),
+         ('publish', ['publish', HANDOFF], ['requests'])]
+
+SETTINGS = '''[PATHS]
+handoffs={workdir}/handoffs/
+data={workdir}/data/
+'''
+
+# Writes what the child process loaded to a file when the process exits
+REPORT = '''
+import sys, json, time, atexit, runpy, resource
+start, report_path = time.perf_counter(), sys.argv[1]
+def report():
+    with open(report_path, 'w') as f:
+        json.dump({'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules),
+                   'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}, f)
+atexit.register(report)
+'''
+# Runs zlo.py with the arguments that follow the report path
+PROBE = REPORT + '''
+sys.argv = sys.argv[2:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+# Loads every module used by create and publish, for comparison
+ALL_MODULES = REPORT + '''
+import arrow, modules.handoff, modules.aws, modules.engine, modules.relink, modules.image_cache
+'''
+
+
+def measure(workdir, code, arguments, repeat):
+    """
+    Runs a child Python process several times.
+    :return: Dict of the fastest wall time, in-process time, peak RSS in MB, and heavy modules loaded
+    """
+    report_path = workdir / 'probe.json'
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code, str(report_path)] + arguments, cwd=str(workdir),
+                       env=dict(os.environ, PYTHONPATH=str(ROOT)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        report = json.loads(report_path.read_text())
+        report_path.unlink()
+        report['wall'] = elapsed
+        runs.append(report)
+    fastest = min(runs, key=lambda run: run['wall'])
+    loaded = {module.split('.')[0] for module in fastest['modules']}
+    rss = max(run['max_rss'] for run in runs) / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return {'seconds': round(fastest['wall'], 3), 'in_process_seconds': round(fastest['seconds'], 3),
+            'peak_rss_mb': round(rss, 1), 'heavy_modules': [m for m in HEAVY_MODULES if m in loaded]}
+
+
+def setup(workdir):
+    (workdir / 'handoffs' / HANDOFF).mkdir(parents=True)     # so create stops at its first check
+    (workdir / 'data').mkdir()
+    (workdir / 'data' / '_loader.csv').write_text('Startup article,360000000000,,support,,,writer,\n')
+    (workdir / 'settings.ini').write_text(SETTINGS.format(workdir=workdir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup of zlo.py subcommands')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each command; the fastest is reported')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    arguments = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='zlo-startup-'))
+    try:
+        setup(workdir)
+        results = {'python': measure(workdir, REPORT, [], arguments.repeat)}
+        leaks = []
+        for name, zlo_arguments, allowed in CASES:
+            result = measure(workdir, PROBE, [str(ZLO)] + zlo_arguments, arguments.repeat)
+            result['leaked'] = [module for module in result['heavy_modules'] if module not in allowed]
+            if result['leaked']:
+                leaks.append(name)
+            results[name] = result
+        results['all modules'] = measure(workdir, ALL_MODULES, [], arguments.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print('\n{:<12} {:>9} {:>13} {}'.format('command', 'seconds', 'peak RSS (MB)', 'heavy modules'))
+    for name, result in results.items():
+        print('{:<12} {:>9.3f} {:>13} {}'.format(name, result['seconds'], result['peak_rss_mb'],
+                                                 ', '.join(result['heavy_modules']) or '-'))
+    if arguments.output:
+        Path(arguments.output).write_text(json.dumps(results, indent=2))
+    if leaks:
+        for name in leaks:
+            print('\n{} loaded {}, which it doesn\'t need.'.format(name, ', '.join(results[name]['leaked'])))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,217 @@
 import time
+import random
+import threading
 from pathlib import Path
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
 
 import requests
+from requests.adapters import HTTPAdapter
 from modules.auth import get_auth
+from modules.metrics import get_metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'PUT', 'DELETE', 'HEAD'}
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+_client = None
+_client_lock = threading.Lock()
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all threads making requests to one Help Center.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        :param rate: Tokens added to the bucket per second
+        :param burst: Maximum number of tokens the bucket can hold
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available, then takes it.
+        :return: Seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+def get_rate_limiter(hc, rate, burst):
+    """
+    Returns the rate limiter for a Help Center, creating it on first use.
+    :param hc: Help Center subdomain, such as 'support' or 'chat'
+    :param rate: Requests per second allowed for the Help Center
+    :param burst: Number of requests that can be made at once before throttling starts
+    :return: RateLimiter object
+    """
+    with _rate_limiters_lock:
+        if hc not in _rate_limiters:
+            _rate_limiters[hc] = RateLimiter(rate, burst)
+        return _rate_limiters[hc]
+
+
+class HttpClient:
+    """
+    Keep-alive HTTP client shared by every request to the Zendesk API in a run. Throttles each Help Center with its
+    own rate limiter and retries rate-limited, failed, and dropped requests with exponential backoff.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=16, max_retries=5, backoff_factor=1.0, max_backoff=60.0,
+                 timeout=60.0, rate=10.0, burst=10):
+        """
+        :param pool_connections: Number of hosts to keep connection pools for
+        :param pool_maxsize: Maximum number of connections kept open to each host
+        :param max_retries: Number of times a request is retried before giving up
+        :param backoff_factor: Base delay in seconds. The delay doubles with each retry
+        :param max_backoff: Longest delay in seconds between two attempts
+        :param timeout: Seconds to wait for the server before the attempt counts as a dropped connection
+        :param rate: Requests per second allowed for each Help Center
+        :param burst: Number of requests that can be made at once to a Help Center before throttling starts
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.rate = rate
+        self.burst = burst
+        self.session = requests.Session()
+        self.session.auth = get_auth()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        """
+        Makes a request, retrying it if the server is rate limiting, returns a 5xx error, or drops the connection.
+        A POST is only retried after a 429 because the server didn't process it.
+        :param method: HTTP method, such as 'GET'
+        :param url: A full endpoint url
+        :param kwargs: Any other arguments accepted by requests
+        :return: Response object, or None if the connection failed on every attempt
+        """
+        method = method.upper()
+        hc = get_subdomain(url)
+        limiter = get_rate_limiter(hc, self.rate, self.burst)
+        metrics = get_metrics()
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            waited = limiter.acquire()
+            if waited:
+                metrics.add_wait(hc, 'throttle', waited)
+            response = None
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.add_request(method, url, None, time.perf_counter() - start)
+                if method not in IDEMPOTENT_METHODS or attempt >= self.max_retries:
+                    print('Connection failed: {}'.format(e))
+                    return None
+                print('Connection dropped. Retrying.')
+                delay = self.get_backoff(attempt)
+            else:
+                metrics.add_request(method, url, response.status_code, time.perf_counter() - start)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                if response.status_code == 429:
+                    print('Rate limited! Please wait.')
+                elif method in IDEMPOTENT_METHODS:
+                    print('Server error {}. Retrying.'.format(response.status_code))
+                else:
+                    return response
+                delay = get_retry_after(response)
+                if delay is None:
+                    delay = self.get_backoff(attempt)
+            metrics.add_wait(hc, '429' if response is not None and response.status_code == 429 else 'retry', delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def get_backoff(self, attempt):
+        """
+        Returns a randomized delay before the next attempt ("full jitter" exponential backoff).
+        :param attempt: Number of attempts already made, minus one
+        :return: Delay in seconds
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+
+def get_client():
+    """
+    Returns the HTTP client shared by every request in the run, creating it from settings.ini on first use.
+    :return: HttpClient object
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from modules.helpers import get_setting
+            _client = HttpClient(pool_connections=int(get_setting('HTTP', 'pool_connections')),
+                                 pool_maxsize=int(get_setting('HTTP', 'pool_maxsize')),
+                                 max_retries=int(get_setting('HTTP', 'max_retries')),
+                                 backoff_factor=float(get_setting('HTTP', 'backoff_factor')),
+                                 max_backoff=float(get_setting('HTTP', 'max_backoff')),
+                                 timeout=float(get_setting('HTTP', 'timeout')),
+                                 rate=float(get_setting('HTTP', 'requests_per_second')),
+                                 burst=int(get_setting('HTTP', 'burst')))
+        return _client
+
+
+def get_retry_after(response):
+    """
+    Returns the delay requested by the Retry-After header of a response.
+    :param response: Response object
+    :return: Delay in seconds, or None if the response has no usable Retry-After header
+    """
+    value = response.headers.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_subdomain(url):
+    """
+    Returns the Help Center subdomain of an endpoint url.
+    :param url: A full endpoint url, such as 'https://support.zendesk.com/api/v2/help_center/articles.json'
+    :return: String, such as 'support'
+    """
+    return urlparse(url).netloc.split('.')[0]
 
 
 def get_resource_list(url, list_name=None, paginate=True):
@@ -18,12 +227,11 @@ def get_resource_list(url, list_name=None, paginate=True):
     else:
         resource = Path(url).stem
     record_list = {resource: []}
+    client = get_client()
     while url:
-        response = requests.get(url, auth=get_auth())
-        if response.status_code == 429:
-            print('Rate limited! Please wait.')
-            time.sleep(int(response.headers['retry-after']))
-            response = requests.get(url, auth=get_auth())
+        response = client.get(url)
+        if response is None:
+            return False
         if response.status_code != 200:
             print('Error with status code {}'.format(response.status_code))
             print(response.text)
@@ -38,6 +246,32 @@ def get_resource_list(url, list_name=None, paginate=True):
     return record_list[resource]
 
 
+def get_cursor_list(url, list_name=None, page_size=100):
+    """
+    Returns a list of HC resources from an endpoint with cursor pagination, using the largest page size.
+    :param url: A full endpoint url, such as 'https://support.zendesk.com/api/v2/help_center/sections/123/articles.json'
+    :param list_name: The list name in the response per the docs. Required if list name not the same as resource name
+    :param page_size: Number of resources per page. 100 is the maximum
+    :return: List of resources, or False if the request failed
+    """
+    resource = list_name or Path(urlparse(url).path).stem
+    records = []
+    client = get_client()
+    url = '{}{}page[size]={}'.format(url, '&' if '?' in url else '?', page_size)
+    while url:
+        response = client.get(url)
+        if response is None:
+            return False
+        if response.status_code != 200:
+            print('Error with status code {}'.format(response.status_code))
+            print(response.text)
+            return False
+        data = response.json()
+        records.extend(data[resource] or [])
+        url = data['links']['next'] if data.get('meta', {}).get('has_more') else None
+    return records
+
+
 def get_resource(url):
     """
     Returns a single HC resource
@@ -45,11 +279,9 @@ def get_resource(url):
     :return: Dict of a resource, or False if the request failed.
     """
     resource = None
-    response = requests.get(url, auth=get_auth())
-    if response.status_code == 429:
-        print('Rate limited! Please wait.')
-        time.sleep(int(response.headers['retry-after']))
-        response = requests.get(url, auth=get_auth())
+    response = get_client().get(url)
+    if response is None:
+        return False
     if response.status_code != 200:
         print('Failed to get record with error {}:'.format(response.status_code))
         print(response.text)
@@ -69,12 +301,9 @@ def post_resource(url, data, status=201):
     :return: Python data, or False if the request failed.
     """
     resource = None
-    headers = {'Content-Type': 'application/json'}
-    response = requests.post(url, json=data, auth=get_auth(), headers=headers)
-    if response.status_code == 429:
-        print('Rate limited! Please wait.')
-        time.sleep(int(response.headers['retry-after']))
-        response = requests.post(url, json=data, auth=get_auth(), headers=headers)
+    response = get_client().post(url, json=data)
+    if response is None:
+        return False
     if response.status_code != status:
         print('Failed to create record with error {}:'.format(response.status_code))
         print(response.text)
@@ -93,12 +322,9 @@ def put_resource(url, data):
     :return: Python data, or False if the request failed.
     """
     resource = None
-    headers = {'Content-Type': 'application/json'}
-    response = requests.put(url, json=data, auth=get_auth(), headers=headers)
-    if response.status_code == 429:
-        print('Rate limited! Please wait.')
-        time.sleep(int(response.headers['retry-after']))
-        response = requests.post(url, json=data, auth=get_auth(), headers=headers)
+    response = get_client().put(url, json=data)
+    if response is None:
+        return False
     if response.status_code != 200:
         print('Failed to update record with error {}:'.format(response.status_code))
         print(response.text)
@@ -116,11 +342,9 @@ def delete_resource(url):
     :param url: A full endpoint url, such as 'https://support.zendesk.com/api/v2/help_center/articles/2342572.json'
     :return: If successful, a 204 status code. If not, None
     """
-    response = requests.delete(url, auth=get_auth())
-    if response.status_code == 429:
-        print('Rate limited! Please wait.')
-        time.sleep(int(response.headers['retry-after']))
-        response = requests.delete(url, auth=get_auth())
+    response = get_client().delete(url)
+    if response is None:
+        return False
     if response.status_code != 204:
         print('Failed to delete record with error {}'.format(response.status_code))
         print(response.text)
@@ -1,8 +1,12 @@
+import os
+
 from YamJam import yamjam
 
 
 def get_auth():
     # return '{}/token'.format('jdoe@example.com'), '9a8b7c6d5e4f3g2h1'
+    if os.environ.get('ZEN_USER') and os.environ.get('ZEN_API_TOKEN'):
+        return '{}/token'.format(os.environ['ZEN_USER']), os.environ['ZEN_API_TOKEN']
     return '{}/token'.format(yamjam()['ZEN_USER']), yamjam()['ZEN_API_TOKEN']
 
 
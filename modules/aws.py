@@ -1,42 +1,128 @@
+import io
+import os
+import time
+import hashlib
+
 import boto3
+from boto3.s3.transfer import TransferConfig, S3UploadFailedError
 from botocore.exceptions import ClientError
 
+from modules.metrics import get_metrics
+
 
-def get_s3_bucket(name):
+def get_s3_bucket(name, endpoint_url=None):
     """
     Returns an s3 bucket.
     :param name: Bucket name. Example: 'zen-marketing-documentation'
+    :param endpoint_url: Url of an S3-compatible server to use instead of Amazon S3. Optional
     :return: s3 bucket
     """
-    s3 = boto3.resource('s3')
+    s3 = boto3.resource('s3', endpoint_url=endpoint_url)
     bucket = s3.Bucket(name)
     return bucket
 
 
-def download_image(bucket, key):
+def get_key_index(bucket, prefixes):
+    """
+    Lists every object under the specified prefixes. Use it to check whether images exist and compare their dates
+    without making a request per image.
+    :param bucket: S3 bucket object
+    :param prefixes: List of key prefixes. Example: ['docs/en/', 'docs/fr/']
+    :return: Dict of objects keyed by key. Each value has the size, etag, and last_modified of the object
+    """
+    index = {}
+    metrics = get_metrics()
+    paginator = bucket.meta.client.get_paginator('list_objects_v2')
+    for prefix in prefixes:
+        start = time.perf_counter()
+        for page in paginator.paginate(Bucket=bucket.name, Prefix=prefix):
+            metrics.add_s3('list', 0, time.perf_counter() - start)
+            start = time.perf_counter()
+            for obj in page.get('Contents', []):
+                index[obj['Key']] = {'size': obj['Size'],
+                                     'etag': obj['ETag'].strip('"'),
+                                     'last_modified': obj['LastModified']}
+    return index
+
+
+def download_image(bucket, key, image_path):
     """
-    Returns an object (i.e., image) in the specified s3 bucket. Checks if it exists first.
+    Downloads an object (i.e., image) in the specified s3 bucket to a file.
     :param bucket: S3 bucket object
     :param key: Image name, including any prefix (i.e., path) to the bucket root. Example: 'docs/en/doggo.png'
-    :return: File object
+    :param image_path: Local path to write the image to. Can be a pathlib object
+    :return: None, or 'error' if the download failed
     """
+    start = time.perf_counter()
     try:
-        bucket.Object(key).load()
-        return bucket.Object(key)
+        bucket.download_file(key, str(image_path))
     except ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            return False
-        else:
-            print('- error code {}'.format(e.response['Error']['Code']))   # something other than a 404
-            return 'error'
+        print('- error code {}'.format(e.response['Error']['Code']))
+        return 'error'
+    get_metrics().add_s3('download', os.path.getsize(str(image_path)), time.perf_counter() - start)
 
 
-def upload_image(bucket, image_path, key):
+def read_image(bucket, key):
+    """
+    Downloads an object (i.e., image) in the specified s3 bucket to memory.
+    :param bucket: S3 bucket object
+    :param key: Image name, including any prefix (i.e., path) to the bucket root. Example: 'docs/en/doggo.png'
+    :return: Bytes of the image, or None if the download failed
+    """
+    buffer = io.BytesIO()
+    start = time.perf_counter()
+    try:
+        bucket.download_fileobj(key, buffer)
+    except ClientError as e:
+        print('- error code {}'.format(e.response['Error']['Code']))
+        return None
+    data = buffer.getvalue()
+    get_metrics().add_s3('download', len(data), time.perf_counter() - start)
+    return data
+
+
+def get_transfer_config(multipart_threshold, multipart_chunksize, max_concurrency):
+    """
+    Returns the transfer settings for uploads.
+    :param multipart_threshold: Size in bytes from which files are uploaded in parts
+    :param multipart_chunksize: Size in bytes of each part
+    :param max_concurrency: Number of threads uploading the parts of one file
+    :return: TransferConfig object
+    """
+    return TransferConfig(multipart_threshold=multipart_threshold, multipart_chunksize=multipart_chunksize,
+                          max_concurrency=max_concurrency)
+
+
+def get_local_etag(image_path, config):
+    """
+    Returns the ETag S3 gives a file uploaded with the specified transfer settings: the MD5 of the file, or for
+    multipart uploads the MD5 of the part MD5s followed by the number of parts.
+    :param image_path: Local path to the image file. Can be a pathlib object
+    :param config: TransferConfig object used for the upload
+    :return: String
+    """
+    with open(str(image_path), 'rb') as f:
+        data = f.read()
+    if len(data) < config.multipart_threshold:
+        return hashlib.md5(data).hexdigest()
+    chunksize = config.multipart_chunksize
+    parts = [hashlib.md5(data[i:i + chunksize]).digest() for i in range(0, len(data), chunksize)]
+    return '{}-{}'.format(hashlib.md5(b''.join(parts)).hexdigest(), len(parts))
+
+
+def upload_image(bucket, image_path, key, config=None):
     """
     Uploads a file to your S3 bucket.
     :param bucket: S3 bucket object
     :param image_path: Local path to the image file. Can be a pathlib object
     :param key: Name of the file in the bucket, including the virtual path. Example: 'docs/fr/doggo.png'
-    :return: None
+    :param config: TransferConfig object. Optional
+    :return: None, or 'error' if the upload failed
     """
-    bucket.upload_file(str(image_path), Key=key, ExtraArgs={'ACL': 'public-read'})
+    start = time.perf_counter()
+    try:
+        bucket.upload_file(str(image_path), Key=key, ExtraArgs={'ACL': 'public-read'}, Config=config)
+    except (ClientError, S3UploadFailedError) as e:
+        print('- failed to upload {}: {}'.format(key, e))
+        return 'error'
+    get_metrics().add_s3('upload', os.path.getsize(str(image_path)), time.perf_counter() - start)
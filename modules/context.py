@@ -0,0 +1,170 @@
+import configparser
+import threading
+
+import modules.helpers as helpers
+
+_context = None
+_context_lock = threading.Lock()
+
+
+class RunContext:
+    """
+    Settings, data files, and service handles loaded once and shared by every function in a run.
+    """
+
+    def __init__(self, settings_file='settings.ini'):
+        """
+        :param settings_file: Path of the settings file
+        """
+        self.config = configparser.ConfigParser()
+        self.config.read(settings_file)
+        self.lock = threading.RLock()
+        self._image_skip_list = None
+        self._store = None
+        self._bucket = None
+        self._mirror = None
+        self._mirror_loaded = False
+        self._image_cache = None
+        self._image_cache_loaded = False
+        self._key_index = {}
+        self._listed_prefixes = set()
+        self._localized_content = None
+
+    @property
+    def image_skip_list(self):
+        """
+        Names of the images to leave out of handoffs, read from image_skip_list.txt.
+        :return: Frozenset of image names
+        """
+        with self.lock:
+            if self._image_skip_list is None:
+                skip_list_path = helpers.get_path_setting('data') / 'image_skip_list.txt'
+                with skip_list_path.open() as f:
+                    self._image_skip_list = frozenset(f.read().splitlines())
+            return self._image_skip_list
+
+    @property
+    def store(self):
+        """
+        The handoffs database in the data folder. If the database is empty and the data folder has the JSON files of
+        an earlier version of the tool, the files are copied into the database first.
+        :return: Store object
+        """
+        with self.lock:
+            if self._store is None:
+                from modules.store import Store, migrate_json_files
+                data_path = helpers.get_path_setting('data')
+                store = Store(data_path / 'zlo.db')
+                if store.is_empty() and ((data_path / 'handoffs.json').exists()
+                                         or (data_path / 'localized_content.json').exists()):
+                    print('\nThe handoffs database is empty. Copying the JSON files of the earlier version into it')
+                    migrate_json_files(store, data_path)
+                self._store = store
+            return self._store
+
+    @property
+    def bucket(self):
+        """
+        The S3 bucket specified in settings.ini.
+        :return: S3 bucket object
+        """
+        with self.lock:
+            if self._bucket is None:
+                import modules.aws as aws
+                self._bucket = aws.get_s3_bucket(helpers.get_aws_setting('bucket_name'),
+                                                 helpers.get_setting('AWS', 'endpoint_url', required=False) or None)
+            return self._bucket
+
+    def get_key_index(self, prefixes):
+        """
+        Lists the objects under the specified prefixes of the S3 bucket. Each prefix is listed once per run, so the
+        handoffs of a batch share the listings.
+        :param prefixes: List of key prefixes. Example: ['docs/en/', 'docs/fr/']
+        :return: Dict returned by aws.get_key_index(), shared by every caller. Update it after uploading an object
+        """
+        with self.lock:
+            missing = [prefix for prefix in prefixes if prefix not in self._listed_prefixes]
+            if missing:
+                import modules.aws as aws
+                self._key_index.update(aws.get_key_index(self.bucket, missing))
+                self._listed_prefixes.update(missing)
+            return self._key_index
+
+    def get_localized_content(self):
+        """
+        Gets the articles and images registered as localized. Read from the handoffs database once per run, then kept
+        current by add_localized_content(), so a long-running command doesn't read it again for each deliverable.
+        :return: Tuple of two dicts: {article_id: set of locales} and {image_name: set of locales}. The dicts are
+        copies the caller can change
+        """
+        with self.lock:
+            if self._localized_content is None:
+                self._localized_content = self.store.get_localized_locales()
+            articles, images = self._localized_content
+            return ({article_id: set(locales) for article_id, locales in articles.items()},
+                    {name: set(locales) for name, locales in images.items()})
+
+    def add_localized_content(self, articles=(), images=()):
+        """
+        Registers articles and images as localized in the handoffs database and in the content read for the run.
+        :param articles: Iterable of (locale, article_id) tuples
+        :param images: Iterable of (locale, image_name) tuples
+        :return: None
+        """
+        articles = list(articles)
+        images = list(images)
+        with self.lock:
+            self.store.add_localized_content(articles, images)
+            if self._localized_content is not None:
+                localized_articles, localized_images = self._localized_content
+                for locale, article_id in articles:
+                    localized_articles.setdefault(int(article_id), set()).add(locale)
+                for locale, name in images:
+                    localized_images.setdefault(name, set()).add(locale)
+
+    @property
+    def client(self):
+        """
+        The HTTP client used for every request to the Zendesk API.
+        :return: HttpClient object
+        """
+        import modules.api as api
+        return api.get_client()
+
+    @property
+    def mirror(self):
+        """
+        The local article mirror, if enabled in settings.ini.
+        :return: ArticleMirror object, or None
+        """
+        with self.lock:
+            if not self._mirror_loaded:
+                from modules.mirror import get_mirror
+                self._mirror = get_mirror()
+                self._mirror_loaded = True
+            return self._mirror
+
+    @property
+    def image_cache(self):
+        """
+        The local image cache, if enabled in settings.ini.
+        :return: ImageCache object, or None
+        """
+        with self.lock:
+            if not self._image_cache_loaded:
+                from modules.image_cache import get_image_cache
+                self._image_cache = get_image_cache()
+                self._image_cache_loaded = True
+            return self._image_cache
+
+
+def get_context():
+    """
+    Returns the context of the current run, creating it on first use.
+    :return: RunContext object
+    """
+    global _context
+    with _context_lock:
+        if _context is None:
+            _context = RunContext()
+        return _context
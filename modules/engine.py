@@ -0,0 +1,345 @@
+import re
+
+from bs4 import BeautifulSoup, Comment
+from lxml import etree
+
+import modules.helpers as helpers
+
+_engines = {}
+
+# What BeautifulSoup's HTML tree builder and its default 'minimal' formatter do, so the lxml engine writes the same markup
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta', 'param',
+             'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'}
+CDATA_TAGS = {'script', 'style'}
+PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+LIST_ATTRIBUTES = {'*': {'class', 'accesskey', 'dropzone'}, 'a': {'rel', 'rev'}, 'link': {'rel', 'rev'},
+                   'td': {'headers'}, 'th': {'headers'}, 'form': {'accept-charset'}, 'object': {'archive'},
+                   'area': {'rel'}, 'icon': {'sizes'}, 'iframe': {'sandbox'}, 'output': {'for'}}
+ASCII_SPACES = set('\x20\x0a\x09\x0c\x0d')
+CHARSET_RE = re.compile(r'((^|;)\s*charset=)([^;]*)', re.M)
+ENTITY_RE = re.compile('[&<>]')
+ENTITIES = {'&': '&amp;', '<': '&lt;', '>': '&gt;'}
+TRAILER_RE = re.compile(r'(<!--.*?-->)', re.S)
+LEADING_NODE_RE = re.compile(r'<!--.*?-->|<\?.*?>', re.S)
+# lxml gives an attribute such as <td nowrap> the value 'nowrap', BeautifulSoup gives it ''. Documents that may contain
+# one are left to BeautifulSoup
+BARE_BOOLEAN_RE = re.compile(r'<[a-zA-Z](?:[^<>"\']|"[^"]*"|\'[^\']*\')*?\s(?:checked|compact|declare|defer|disabled|ismap|multiple|nohref|'
+                             r'noresize|noshade|nowrap|readonly|selected)(?=[\s/>])(?!\s*=)', re.I)
+
+
+class SoupEngine:
+    """
+    Parses and writes article HTML with BeautifulSoup.
+    """
+
+    name = 'bs4'
+
+    def parse_article(self, body, title):
+        """
+        Returns a tree for an article body from the API, with comments stripped, a utf-8 head, and the title as h1.
+        :param body: HTML of the article body
+        :param title: Article title
+        :return: A tree object, or None if the body has no content
+        """
+        body = '<html>' + body + '</html>'  # to parse all the file (prevent `<p> </p>` None-type errors)
+        tree = BeautifulSoup(body, 'lxml')
+        if tree.html is None or tree.body is None:
+            return None
+        comments = tree.find_all(string=lambda text: isinstance(text, Comment))
+        [comment.extract() for comment in comments]
+        head = tree.new_tag('head')
+        meta = tree.new_tag('meta')
+        meta['charset'] = 'utf-8'
+        head.append(meta)
+        tree.body.insert_before(head)
+        h1 = tree.new_tag('h1')
+        h1.string = title
+        tree.body.insert(0, h1)
+        return tree
+
+    def parse_file(self, path):
+        return BeautifulSoup(path.read_text(encoding='utf-8'), 'lxml')
+
+    def serialize(self, tree):
+        return str(tree)
+
+    def find_elements(self, tree, tag, attribute, text=''):
+        """
+        Returns the elements with the specified tag whose attribute contains the text.
+        :param tree: A tree object
+        :param tag: Tag name, such as 'img'
+        :param attribute: Attribute name, such as 'src'
+        :param text: Text the attribute value must contain. Leave empty to match any element with the attribute
+        :return: List of elements
+        """
+        return tree.find_all(tag, attrs={attribute: lambda value: value is not None and text in value})
+
+    def find_links(self, tree):
+        """
+        Returns the links and image sources of a tree in one pass, in document order.
+        :param tree: A tree object
+        :return: List of (element, attribute, value) tuples for each a with an href and each img with a src
+        """
+        links = []
+        for element in tree.find_all(['a', 'img']):
+            attribute = 'href' if element.name == 'a' else 'src'
+            value = element.get(attribute)
+            if value is not None:
+                links.append((element, attribute, value))
+        return links
+
+    def get_attribute(self, element, attribute):
+        return element.get(attribute)
+
+    def set_attribute(self, element, attribute, value):
+        element[attribute] = value
+
+    def pop_title(self, tree):
+        """
+        Removes the first h1 from the tree and returns its text.
+        :param tree: A tree object
+        :return: String, or None if the tree has no h1
+        """
+        if tree.h1 is None:
+            return None
+        title = ' '.join(tree.h1.stripped_strings)
+        tree.h1.decompose()
+        return title
+
+
+class LxmlDocument:
+    """
+    An lxml tree, the position of its doctype among the comments before the root, or None if its markup declared no
+    doctype, and the whitespace and comments after </html>. lxml reports a default doctype even if there's none,
+    doesn't keep its position, and drops the whitespace.
+    """
+
+    def __init__(self, tree, doctype_index, trailer):
+        self.tree = tree
+        self.root = tree.getroot()
+        self.doctype_index = doctype_index
+        self.trailer = trailer
+
+
+class LxmlEngine:
+    """
+    Parses article HTML with lxml and writes it the way BeautifulSoup does, so both engines produce the same files.
+    """
+
+    name = 'lxml'
+
+    def __init__(self):
+        self.fallback = SoupEngine()
+
+    def parse(self, markup):
+        parser = etree.HTMLParser(strip_cdata=False, recover=True, encoding='utf-8')
+        try:
+            root = etree.fromstring(markup.encode('utf-8'), parser)
+        except etree.XMLSyntaxError:
+            return None
+        if root is None:
+            return None
+        for sibling in root.itersiblings(preceding=True):
+            _collapse_whitespace(sibling, False)
+        _collapse_whitespace(root, False)
+        doctype = markup.lower().find('<!doctype')
+        doctype_index = None if doctype == -1 else len(LEADING_NODE_RE.findall(markup[:doctype]))
+        return LxmlDocument(root.getroottree(), doctype_index, _get_trailer(markup))
+
+    def parse_article(self, body, title):
+        if BARE_BOOLEAN_RE.search(body):
+            return self.fallback.parse_article(body, title)
+        document = self.parse('<html>' + body + '</html>')
+        if document is None:
+            return None
+        root = document.root
+        body = root.find('body')
+        if root.tag != 'html' or body is None:
+            return None
+        for comment in root.xpath('//comment()'):
+            if comment.text:    # BeautifulSoup doesn't find empty comments, which are only left in <pre> and <textarea>
+                _remove(comment)
+        head = etree.Element('head')
+        etree.SubElement(head, 'meta', charset='utf-8')
+        body.addprevious(head)
+        h1 = etree.Element('h1')
+        h1.text = title
+        h1.tail, body.text = body.text, None
+        body.insert(0, h1)
+        return document
+
+    def parse_file(self, path):
+        markup = path.read_text(encoding='utf-8')
+        if BARE_BOOLEAN_RE.search(markup) or _get_trailer(markup) is None:   # lxml drops the markup after </html>
+            return self.fallback.parse_file(path)
+        return self.parse(markup)
+
+    def serialize(self, document):
+        if not isinstance(document, LxmlDocument):
+            return self.fallback.serialize(document)
+        out = []
+        root = document.root
+        nodes = list(reversed(list(root.itersiblings(preceding=True)))) + [root]
+        for i, node in enumerate(nodes):
+            if document.doctype_index is not None and i == min(document.doctype_index, len(nodes) - 1):
+                docinfo = document.tree.docinfo
+                doctype = docinfo.root_name
+                if docinfo.public_id:
+                    doctype += ' PUBLIC "{}"'.format(docinfo.public_id)
+                    if docinfo.system_url:
+                        doctype += ' "{}"'.format(docinfo.system_url)
+                elif docinfo.system_url:
+                    doctype += ' SYSTEM "{}"'.format(docinfo.system_url)
+                out.append('<!DOCTYPE {}>\n'.format(doctype))
+            _serialize(node, out, False)
+        out.append(document.trailer)
+        return ''.join(out)
+
+    def find_elements(self, document, tag, attribute, text=''):
+        if not isinstance(document, LxmlDocument):
+            return self.fallback.find_elements(document, tag, attribute, text)
+        return document.root.xpath('//{0}[@{1} and contains(@{1}, $text)]'.format(tag, attribute), text=text)
+
+    def find_links(self, document):
+        if not isinstance(document, LxmlDocument):
+            return self.fallback.find_links(document)
+        links = []
+        for element in document.root.xpath('//a[@href] | //img[@src]'):
+            attribute = 'href' if element.tag == 'a' else 'src'
+            links.append((element, attribute, element.get(attribute)))
+        return links
+
+    def get_attribute(self, element, attribute):
+        return element.get(attribute)
+
+    def set_attribute(self, element, attribute, value):
+        if not isinstance(element, etree._Element):
+            return self.fallback.set_attribute(element, attribute, value)
+        element.set(attribute, value)
+
+    def pop_title(self, document):
+        if not isinstance(document, LxmlDocument):
+            return self.fallback.pop_title(document)
+        h1 = next(document.root.iter('h1'), None)
+        if h1 is None:
+            return None
+        strings = [string.strip() for string in h1.xpath('.//text()')]
+        _remove(h1)
+        return ' '.join(string for string in strings if string)
+
+
+def _get_trailer(markup):
+    """
+    Returns the whitespace and comments after </html> as BeautifulSoup writes them, or None if anything else is there.
+    """
+    end = markup.lower().rfind('</html>')
+    if end == -1:
+        return ''
+    trailer = []
+    for i, part in enumerate(TRAILER_RE.split(markup[end + 7:])):
+        if i % 2:
+            trailer.append(part)
+        elif part and any(c not in ASCII_SPACES for c in part):
+            return None
+        elif part:
+            trailer.append('\n' if '\n' in part else ' ')
+    return ''.join(trailer)
+
+
+def _collapse_whitespace(element, preserve):
+    """
+    Replaces strings and comments made only of ASCII whitespace with one newline or space, as BeautifulSoup does when it
+    parses. An empty comment counts as whitespace.
+    """
+    preserve = preserve or element.tag in PRESERVE_WHITESPACE_TAGS
+    if not preserve:
+        if element.text and all(c in ASCII_SPACES for c in element.text):
+            element.text = '\n' if '\n' in element.text else ' '
+        elif element.tag is etree.Comment and not element.text:
+            element.text = ' '
+    for child in element:
+        if isinstance(child.tag, str) or child.tag is etree.Comment:
+            _collapse_whitespace(child, preserve)
+        if child.tail and not preserve and all(c in ASCII_SPACES for c in child.tail):
+            child.tail = '\n' if '\n' in child.tail else ' '
+
+
+def _remove(element):
+    """
+    Removes an element from its tree but keeps the text that follows it.
+    """
+    parent = element.getparent()
+    if element.tail:
+        previous = element.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or '') + element.tail
+        else:
+            parent.text = (parent.text or '') + element.tail
+    parent.remove(element)
+
+
+def _escape(text):
+    return ENTITY_RE.sub(lambda match: ENTITIES[match.group()], text)
+
+
+def _serialize(element, out, cdata):
+    """
+    Appends the markup of an element and its tail to out, formatted like BeautifulSoup's 'minimal' formatter.
+    """
+    tag = element.tag
+    if tag is etree.Comment:
+        out.append('<!--{}-->'.format(element.text or ''))
+    elif tag is etree.PI:
+        out.append('<?{} {}?>'.format(element.target, element.text or ''))
+    elif isinstance(tag, str):
+        out.append('<' + tag)
+        list_attributes = LIST_ATTRIBUTES['*'] | LIST_ATTRIBUTES.get(tag, set())
+        for name, value in sorted(element.attrib.items()):
+            if name in list_attributes:
+                value = ' '.join(value.split())
+            elif tag == 'meta':
+                if name == 'charset':
+                    value = 'utf-8'
+                elif name == 'content' and 'charset' not in element.attrib and any(
+                        v.lower() == 'content-type' for v in element.get('http-equiv', '').split()):
+                    value = CHARSET_RE.sub(lambda match: match.group(1) + 'utf-8', value)
+            value = _escape(value)
+            if '"' in value:
+                if "'" in value:
+                    value = '"{}"'.format(value.replace('"', '&quot;'))
+                else:
+                    value = "'{}'".format(value)
+            else:
+                value = '"{}"'.format(value)
+            out.append(' {}={}'.format(name, value))
+        if tag in VOID_TAGS and element.text is None and len(element) == 0:
+            out.append('/>')
+        else:
+            out.append('>')
+            child_cdata = tag in CDATA_TAGS
+            if element.text:
+                out.append(element.text if child_cdata else _escape(element.text))
+            for child in element:
+                _serialize(child, out, child_cdata)
+            out.append('</{}>'.format(tag))
+    if element.tail:
+        out.append(element.tail if cdata else _escape(element.tail))
+
+
+def get_engine(name=None):
+    """
+    Returns the HTML engine specified in the HTML section of settings.ini.
+    :param name: 'bs4' or 'lxml'. Optional. Overrides the setting
+    :return: SoupEngine or LxmlEngine object
+    """
+    if name is None:
+        name = helpers.get_setting('HTML', 'engine', required=False) or 'bs4'
+    if name not in _engines:
+        if name == 'lxml':
+            _engines[name] = LxmlEngine()
+        elif name == 'bs4':
+            _engines[name] = SoupEngine()
+        else:
+            print(f'\'{name}\' is not a valid HTML engine in settings.ini. Exiting.')
+            exit()
+    return _engines[name]
@@ -1,25 +1,29 @@
+import os
 import re
 import csv
-from urllib.parse import urlparse
-from shutil import copyfile
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-import arrow
 import modules.helpers as helpers
 import modules.api as api
-import modules.aws as aws
+import modules.journal as journal
+from modules.context import get_context
+from modules.metrics import get_metrics
+
+DATE_NAME_RE = re.compile(r'^\d{4}-\d{2}-\d{2}')    # handoff named after its date, such as 2018-12-24
+
+_relinker = None    # set in each process preparing deliverable articles
 
 
 def load_handoff_data(handoff_name, custom=False):
     """
-    Reads the handoff's _loader.csv file and updates the handoffs.json file.
+    Reads the handoff's _loader.csv file and updates the handoffs database.
     :param handoff_name: Name of handoff specified on the command line
     :param custom: Boolean. If true, use _custom_loader.json.
     :return:
     """
-    handoff = {}
     articles = []
-    file = helpers.get_path_setting('data') / 'handoffs.json'
-    handoffs = helpers.read_json(file)
 
     if not custom:
         loader_file = helpers.get_path_setting('data') / '_loader.csv'
@@ -39,36 +43,73 @@ def load_handoff_data(handoff_name, custom=False):
     if custom:
         loader_file = helpers.get_path_setting('data') / '_custom_loader.json'
         help_centers = helpers.read_json(loader_file)
-        for hc in help_centers:
-            hc_section_skips = []
-            if help_centers[hc]['section_skips']:   # get section ids
-                section: str
-                [hc_section_skips.append(int(section.split('-')[0])) for section in help_centers[hc]['section_skips']]
-
-            print(f'\nFetching {hc} articles')
-            root = 'https://{}.zendesk.com/api/v2/help_center'.format(hc)
-            for category in help_centers[hc]['categories']:
-                url = '{}/articles/search.json?category={}'.format(root, category)
-                articles_in_category = api.get_resource_list(url, 'results')
-                for article in articles_in_category:
-                    if article['section_id'] in hc_section_skips:
-                        continue
-                    record = {'title': article['title'],
-                              'id': article['id'],
-                              'deferred_id': None,
-                              'hc': hc,
-                              'en_images': False,
-                              'bump_ok': False,
-                              'writer': article['author_id'],
-                              'comments': 'Custom handoff'}
-                    print('- {}'.format(article['title']))
-                    articles.append(record)
-
-    handoff['articles'] = articles
-    handoff['status'] = 'in progress'
-    handoffs[handoff_name] = handoff
-    helpers.write_json(file, handoffs)
-    print('\nSuccessfully loaded the handoff data to handoffs.json\n')
+        for hc, article in get_custom_articles(help_centers):
+            record = {'title': article['title'],
+                      'id': article['id'],
+                      'deferred_id': None,
+                      'hc': hc,
+                      'en_images': False,
+                      'bump_ok': False,
+                      'writer': article['author_id'],
+                      'comments': 'Custom handoff'}
+            print('- {}'.format(article['title']))
+            articles.append(record)
+
+    get_context().store.save_handoff(handoff_name, articles)
+    print('\nSuccessfully loaded the handoff data to the handoffs database\n')
+
+
+def get_custom_articles(help_centers, workers=None):
+    """
+    Lists the published articles in the categories of a custom loader file. The sections of all the categories are
+    listed at the same time, then the articles of all the sections except the skipped ones. Articles are read from
+    the article mirror if it's enabled.
+    :param help_centers: Dict of the custom loader file, with the categories and section_skips of each Help Center
+    :param workers: Number of concurrent requests. Defaults to download_workers in settings.ini
+    :return: List of (hc, article) tuples, in the order of the categories and sections
+    """
+    if workers is None:
+        workers = int(helpers.get_setting('HTTP', 'download_workers'))
+    mirror = get_context().mirror
+
+    def list_sections(category):
+        hc, category_id = category
+        url = '{}/categories/{}/sections.json'.format(helpers.get_hc_root(hc), category_id)
+        sections = api.get_cursor_list(url)
+        if sections is False:
+            print('\nDouble-check the category id {} in the custom loader file.\n'.format(category_id))
+        return sections
+
+    def list_articles(section):
+        hc, section_id = section
+        if hc in synced:
+            return mirror.get_section_articles(hc, [section_id])
+        url = '{}/sections/{}/articles.json'.format(helpers.get_hc_root(hc), section_id)
+        return api.get_cursor_list(url)
+
+    categories = [(hc, category_id) for hc in help_centers for category_id in help_centers[hc]['categories']]
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        synced = set()
+        if mirror is not None:
+            synced = {hc for hc, ok in zip(help_centers, executor.map(mirror.sync, help_centers)) if ok}
+        print('\nListing the sections of {} categories'.format(len(categories)))
+        category_sections = list(executor.map(list_sections, categories))
+        if False in category_sections:
+            exit()
+        sections = []
+        for (hc, category_id), category in zip(categories, category_sections):
+            section_skips = {int(section.split('-')[0]) for section in help_centers[hc]['section_skips'] or []}
+            sections.extend((hc, section['id']) for section in category if section['id'] not in section_skips)
+        print('Listing the articles of {} sections'.format(len(sections)))
+        section_articles = list(executor.map(list_articles, sections))
+    if False in section_articles:
+        print('\nError listing the articles of a section. Exiting.\n')
+        exit()
+
+    articles = []
+    for (hc, section_id), section in zip(sections, section_articles):
+        articles.extend((hc, article) for article in section if not article.get('draft'))
+    return articles
 
 
 def get_handoff_manifest(handoff_name):
@@ -77,123 +118,246 @@ def get_handoff_manifest(handoff_name):
     :param handoff_name: Name of handoff specified on the command line
     :return: List articles and their properties
     """
-    file = helpers.get_path_setting('data') / 'handoffs.json'
-    handoffs = helpers.read_json(file)
-    handoff_manifest = handoffs[handoff_name]['articles']
+    handoff_manifest = get_context().store.get_handoff_manifest(handoff_name)
+    if handoff_manifest is None:
+        print('\nNo handoff named {} in the handoffs database. Exiting.\n'.format(handoff_name))
+        exit()
     return handoff_manifest
 
 
-def download_articles(handoff_manifest):
+def remove_handed_off(handoff_manifest, handed_off):
     """
-    Downloads each article from the specified Help Center, converts the HTML into a Beautiful Soup tree, and stores it
+    Leaves out of a handoff the articles already in an earlier handoff of a batch.
+    :param handoff_manifest: List of articles returned by get_handoff_manifest()
+    :param handed_off: Set of (hc, article_id) of the articles in the earlier handoffs. The articles kept are added
+    :return: List of the articles of the manifest not in the earlier handoffs
+    """
+    articles = []
+    for article in handoff_manifest:
+        key = (article['hc'], article['id'])
+        if key in handed_off:
+            print('- {} -> {} is in an earlier handoff of the batch. Skipping.'.format(article['hc'], article['id']))
+            continue
+        handed_off.add(key)
+        articles.append(article)
+    return articles
+
+
+def download_articles(handoff_manifest, workers=None):
+    """
+    Downloads each article from the specified Help Center, converts the HTML into a tree, and stores it
     in a dictionary with necessary data for creating the handoff.
     :param handoff_manifest: List of articles in the handoff and their properties
+    :param workers: Number of concurrent downloads. Defaults to download_workers in settings.ini. 1 downloads serially
     :return: Dictionary of articles. Each object consists of an article id, hc, tree, and S3 image names
     """
     print('\nDownloading articles from Help Center')
-
-    download_list = {}
-    for article in handoff_manifest:
-        download_list[article['id']] = article['hc']    # assign id:hc value
-
-    handoff = []
-    for article in handoff_manifest:
+    if workers is None:
+        workers = int(helpers.get_setting('HTTP', 'download_workers'))
+    mirror = get_context().mirror
+    if mirror is not None:
+        for hc in sorted({article['hc'] for article in handoff_manifest}):
+            mirror.sync(hc)
+
+    def download(article):
         hc = article['hc']
-        root = f'https://{hc}.zendesk.com/api/v2/help_center'
+        root = helpers.get_hc_root(hc)
         url = root + '/articles/{}.json'.format(article['id'])
         print('- {} -> {}'.format(hc, article['id']))
-        response = api.get_resource(url)
-        if response is False:
-            print('\nDouble-check the article id in loc spreadsheet.\n')
-            exit()
+        response = mirror.get_article(hc, article['id']) if mirror is not None else None
+        if response is None:
+            response = api.get_resource(url)
+            if response is False:
+                print('\nDouble-check the article id in loc spreadsheet.\n')
+                exit()
+            if mirror is not None and response is not None:
+                mirror.put_articles(hc, [response])
         tree = helpers.create_tree_from_api(response)
         if tree is None:
-            continue
+            return None
 
         if article['en_images']:
             images = []
         else:
             images = helpers.get_article_images(tree)
 
-        handoff.append({'id': article['id'] if article['deferred_id'] is None else article['deferred_id'],
-                        'hc': hc,
-                        'tree': tree,
-                        'images': images})
+        return {'id': article['id'] if article['deferred_id'] is None else article['deferred_id'],
+                'hc': hc,
+                'tree': tree,
+                'images': images}
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        results = executor.map(download, handoff_manifest)     # results are in manifest order
+        handoff = [article for article in results if article is not None]
     return handoff
 
 
-def write_articles(handoff, handoff_path):
+def write_articles(handoff, handoff_path, sent_hashes=None, package=None):
     """
-    Writes downloaded articles to the handoff folder.
+    Writes downloaded articles to the handoff folder. Sets the hash of each article's normalized markup.
     :param handoff: A list of article dictionaries returned by download_articles()
     :param handoff_path: A Path object that specifies the handoff folder
+    :param sent_hashes: Dict of {(hc, id): hash} of the articles sent in earlier handoffs. Optional. If specified,
+    articles identical to the ones last sent are skipped and marked as unchanged
+    :param package: HandoffPackage object. Optional. If specified, the articles are also added to the package
     :return:
     """
     print('\nWriting downloaded articles to the handoff folder')
+    unchanged = 0
     for article in handoff:
         markup = helpers.get_article_markup(article['tree'])
         if markup is None:
             print('- the {} article {} in Help Center has no content. Skipping.'.format(article['hc'], article['id']))
             continue
+        article['hash'] = journal.get_hash(' '.join(markup.split()))
+        filename = '{}.html'.format(article['id'])
+        if sent_hashes is not None and sent_hashes.get((article['hc'], str(article['id']))) == article['hash']:
+            print('- /{}/{} unchanged since the last handoff. Skipping.'.format(article['hc'], filename))
+            article['unchanged'] = True
+            unchanged += 1
+            continue
         handoff_article_folder = handoff_path / article['hc'] / 'articles'
         if not handoff_article_folder.exists():
             handoff_article_folder.mkdir(parents=True)
-        filename = '{}.html'.format(article['id'])
         article_path = handoff_article_folder / filename
         article_path.write_text(markup,  encoding='utf-8')
+        if package is not None:
+            package.add('{}/{}/articles/{}'.format(handoff_path.name, article['hc'], filename), markup.encode('utf-8'))
         print('- /{}/{}'.format(article['hc'], filename))
+    if sent_hashes is not None:
+        print('- skipped {} unchanged articles'.format(unchanged))
 
 
-def download_images(handoff, handoff_path):
+def download_images(handoff, handoff_path, locales, sent_hashes=None, package=None):
     """
-    Downloads the images for each article from S3 to the handoff folder.
+    Downloads the images for each article from S3 to the handoff folder. Sets the ETag of each downloaded image.
+    Images are fetched through the image cache if it's enabled, and an image used by several articles is only
+    downloaded once. An image is only included if at least one locale needs it: the locale's folder on S3 has no
+    copy of the image, or a copy older than the English one. The locales that need each image are written to
+    image_locales.json in the handoff folder.
     :param: handoff: A list of article dictionaries returned by download_articles()
     :param: handoff_path: A Path object that specifies the handoff folder
+    :param locales: List of the Help Center locales the handoff is translated into, such as ['de', 'pt-br']
+    :param sent_hashes: Dict of {(hc, image_name): etag} of the images sent in earlier handoffs. Optional. If
+    specified, images identical to the ones last sent are skipped
+    :param package: HandoffPackage object. Optional. If specified, the images are also added to the package
     :return:
     """
+    import modules.aws as aws
+    import modules.image_cache as image_cache
+
     print('\nDownloading images to the handoff folder')
-    bucket_name = helpers.get_aws_setting('bucket_name')
     key_prefix = helpers.get_aws_setting('key_prefix')
-    loc_key_prefix = helpers.get_aws_setting('loc_key_prefix')
-    bucket = aws.get_s3_bucket(bucket_name)
+    loc_key_prefixes = {locale: 'docs/{}/'.format(helpers.get_s3_locale(locale)) for locale in locales}
+    bucket = get_context().bucket
+    key_index = get_context().get_key_index([key_prefix] + sorted(set(loc_key_prefixes.values())))
+    image_locales = {}
+    cache = get_context().image_cache
+    placed = set()
+    unchanged = 0
 
     for article in handoff:
         if not article['images']:   # article contains no images: go to next article
             continue
-        for image_name in article['images']:
-
-            image_qualifies = True
+        article['image_etags'] = {}
+        for image_name in list(article['images']):
 
             if '%' in image_name:     # image path has disallowed character
                 print(f'- invalid image path: {image_name}')
                 continue
 
             key = key_prefix + image_name
-            image = aws.download_image(bucket, key)
-            if image == 'error':
+            image = key_index.get(key)
+            if image is None:
                 continue
 
-            # get loc version of image for comparison
-            loc_key = loc_key_prefix + image_name
-            localized_image = aws.download_image(bucket, loc_key)
-            if localized_image == 'error':
-                continue
-
-            if localized_image:
-                if arrow.get(localized_image.last_modified) > arrow.get(image.last_modified):
-                    image_qualifies = False
-
-            if image_qualifies:
+            # locales whose version of the image is missing or older than the en-us image
+            needed_by = []
+            for locale, loc_key_prefix in loc_key_prefixes.items():
+                localized_image = key_index.get(loc_key_prefix + image_name)
+                if localized_image is None or localized_image['last_modified'] <= image['last_modified']:
+                    needed_by.append(locale)
+            image_qualifies = bool(needed_by)
+
+            if image_qualifies and sent_hashes is not None \
+                    and sent_hashes.get((article['hc'], image_name)) == image['etag']:
+                print('- /{}/{} unchanged since the last handoff. Skipping.'.format(article['hc'], image_name))
+                article['images'].remove(image_name)
+                unchanged += 1
+            elif image_qualifies:
                 handoff_image_folder = handoff_path / article['hc'] / 'images'
                 if not handoff_image_folder.exists():
                     handoff_image_folder.mkdir(parents=True)
-                print('- /{}/{}'.format(article['hc'], image_name))
-                filename = '{}/{}'.format(str(handoff_image_folder), image_name)
-                image.download_file(filename)
+                image_path = handoff_image_folder / image_name
+                if image_path not in placed:    # not already in the handoff for an earlier article
+                    print('- /{}/{}'.format(article['hc'], image_name))
+                    if cache is not None:
+                        cached_path = cache.fetch(bucket, key, image['etag'])
+                        if cached_path is None:
+                            continue
+                        image_cache.place_image(cached_path, image_path)
+                        data = cached_path.read_bytes() if package is not None else None
+                    elif package is None:
+                        aws.download_image(bucket, key, image_path)
+                    else:
+                        data = aws.read_image(bucket, key)
+                        if data is None:
+                            continue
+                        image_path.write_bytes(data)
+                    if package is not None:
+                        package.add('{}/{}/images/{}'.format(handoff_path.name, article['hc'], image_name), data)
+                    placed.add(image_path)
+                article['image_etags'][image_name] = image['etag']
+                image_locales.setdefault(article['hc'], {})[image_name] = needed_by
             else:
-                # skipping - localized image is newer on s3, so en-us translation has not been updated
+                # skipping - localized images are newer on s3, so en-us translation has not been updated
                 #     since the last handoff
                 article['images'].remove(image_name)
+    if sent_hashes is not None:
+        print('- skipped {} unchanged images'.format(unchanged))
+    if image_locales:
+        write_image_locales(image_locales, locales, handoff_path, package)
+
+
+def write_image_locales(image_locales, locales, handoff_path, package=None):
+    """
+    Writes the locales that need each image of the handoff to image_locales.json in the handoff folder, and prints the
+    number of images each locale needs.
+    :param image_locales: Dict of {hc: {image_name: [locale, ...]}}
+    :param locales: List of the locales of the handoff
+    :param handoff_path: A Path object that specifies the handoff folder
+    :param package: HandoffPackage object. Optional. If specified, the file is also added to the package
+    :return: None
+    """
+    counts = {locale: 0 for locale in locales}
+    for images in image_locales.values():
+        for needed_by in images.values():
+            for locale in needed_by:
+                counts[locale] += 1
+    manifest_path = handoff_path / 'image_locales.json'
+    helpers.write_json(manifest_path, {'locales': locales, 'images': image_locales, 'counts': counts})
+    if package is not None:
+        package.add('{}/{}'.format(handoff_path.name, manifest_path.name), manifest_path.read_bytes())
+    print('\nImages needed by each locale (see {}):'.format(manifest_path.name))
+    for locale in locales:
+        print('- {}: {}'.format(locale, counts[locale]))
+
+
+def save_ledger(handoff, handoff_name):
+    """
+    Records the hashes of the articles and images written to a handoff, so later handoffs can leave out the
+    content that hasn't changed since.
+    :param handoff: A list of article dictionaries processed by write_articles() and download_images()
+    :param handoff_name: Handoff name
+    :return: None
+    """
+    entries = []
+    for article in handoff:
+        if 'hash' in article and not article.get('unchanged'):
+            entries.append(('article', article['hc'], str(article['id']), article['hash']))
+        for image_name, etag in article.get('image_etags', {}).items():
+            entries.append(('image', article['hc'], image_name, etag))
+    get_context().store.save_ledger(handoff_name, entries)
 
 
 def print_handoff_email(handoff_name):
@@ -202,6 +366,8 @@ def print_handoff_email(handoff_name):
     :param handoff_name: Name for the handoff specified on the command line
     :return:
     """
+    import arrow
+
     utc = arrow.utcnow()
     local = utc.to('US/Pacific')
     date = local.format('YYYY-MM-DD')
@@ -216,12 +382,20 @@ def print_handoff_email(handoff_name):
 
 
 def get_deliverable(delivery_path, defer=None, subset=None):
+    """
+    Gets the images and article files of a handoff deliverable. The articles are read later by prepare_articles().
+    :param delivery_path: Path of the translations folder of the handoff
+    :param defer: List of ids of the articles to leave out. Optional
+    :param subset: List of ids of the only articles to include. Optional
+    :return: Dict of the images and article files to publish
+    """
     if defer and subset:
         print('\nError. Can only specify defer or subset arguments, not both. Exiting.\n')
         exit()
 
     print('\nGetting the deliverable...')
-    deliverable = {'images': [], 'articles': []}
+    deliverable = {'path': delivery_path, 'images': [], 'articles': [], 'published': [], 'unchanged': [],
+                   'bad_links': [], 'failed_images': []}
     image_names = []
     if defer or subset:
         handoff_name = delivery_path.parts[-2]
@@ -238,10 +412,7 @@ def get_deliverable(delivery_path, defer=None, subset=None):
             continue
         parts = image_path.parts
         locale = parts[-4].lower()
-        if locale == 'pt-br':
-            key = 'docs/pt/{}'.format(name)
-        else:
-            key = 'docs/{}/{}'.format(locale, name)
+        key = 'docs/{}/{}'.format(helpers.get_s3_locale(locale), name)
         deliverable['images'].append({'locale': locale, 'name': name, 'key': key, 'path': image_path})
 
     article_paths = sorted(delivery_path.glob('**/*.html'))
@@ -251,121 +422,366 @@ def get_deliverable(delivery_path, defer=None, subset=None):
             continue
         if subset and int(source_id) not in subset:
             continue
-
-        tree = helpers.create_tree_from_file(article_path)
-        if tree is None:
-            continue
         parts = article_path.parts
-        deliverable['articles'].append({'locale': parts[-4].lower(), 'hc': parts[-3],
-                                        'source_id': source_id, 'tree': tree})
+        deliverable['articles'].append({'locale': parts[-4].lower(), 'hc': parts[-3], 'source_id': source_id,
+                                        'path': article_path})
 
     return deliverable
 
 
-def register_new_localized_content(deliverable):
-    print('\nRegistering new localized content...')
-    file = helpers.get_path_setting('data') / 'localized_content.json'
-    localized_content = helpers.read_json(file)
-    is_updated = False
-    for image in deliverable['images']:
-        if image['name'] not in localized_content[image['locale']]['images']:
-            localized_content[image['locale']]['images'].append(image['name'])
-            is_updated = True
-    for article in deliverable['articles']:
-        if int(article['source_id']) not in localized_content[article['locale']]['articles']:
-            localized_content[article['locale']]['articles'].append(int(article['source_id']))
-            is_updated = True
-    if is_updated:
-        file = helpers.get_path_setting('data') / 'localized_content.json'
-        backup_file = helpers.get_path_setting('data') / 'localized_content_backup.json'
-        copyfile(file, backup_file)
-        helpers.write_json(file, localized_content)
-
-
-def relink_articles(deliverable):
-    print('\nUpdating article links...')
-    file = helpers.get_path_setting('data') / 'localized_content.json'
-    localized_content = helpers.read_json(file)
-
-    for article in deliverable['articles']:
-        tree = article['tree']
-        locale = article['locale']
-
-        hrefs = tree.find_all('a', href=re.compile('/hc/en-us/articles'))
-        for link in hrefs:
-            parsed_link = urlparse(link['href'])
-            if '/hc/en-us/articles/' not in parsed_link.path:
+def get_batch_names(handoff_names, start=None, end=None, available=()):
+    """
+    Gets the handoffs to process in a batch.
+    :param handoff_names: List of handoff names specified on the command line
+    :param start: First date of a range of handoffs named yyyy-mm-dd. Optional
+    :param end: Last date of the range. Optional. Default is the last handoff
+    :param available: List of the names of the handoffs that can be processed, sorted
+    :return: List of the handoff names, without duplicates. The handoffs in the range follow the named ones
+    """
+    names = list(handoff_names)
+    if start or end:
+        start = start or ''
+        names += [name for name in available
+                  if DATE_NAME_RE.match(name) and start <= name[:10] and (end is None or name[:10] <= end)]
+    unique = []
+    for name in names:
+        if name not in unique:
+            unique.append(name)
+    return unique
+
+
+def dedupe_deliverables(deliverables):
+    """
+    Leaves out of each deliverable of a batch the translations and images also in a later deliverable, so only the
+    latest ones are published. The images of the batch are all uploaded with the first deliverable, so every image is
+    on S3 before the articles of any deliverable that use it are published. Each deliverable's relinker is also told
+    about the content of the others.
+    :param deliverables: List of dicts returned by get_deliverable(), in the order they'll be published
+    :return: None
+    """
+    later_articles = set()
+    later_images = set()
+    for deliverable in reversed(deliverables):
+        articles = []
+        for article in deliverable['articles']:
+            key = (article['locale'], article['source_id'])
+            if key in later_articles:
+                print('- {} translation of {} is in a later handoff. Skipping it in {}.'.format(
+                    article['locale'], article['source_id'], deliverable['path'].parent.name))
                 continue
-            article_id = parsed_link.path.split('/articles/')[1]        # remove the url path prefix
-            article_id = article_id.split('-')[0]                       # remove dasherized title suffix
-            article_id = re.sub('[^0-9]', '', article_id)               # remove any remaining non-numeric characters
-
-            if not article_id.isdigit():                                # check for bad link
-                print('\nThe following article contains a HC link that does not use an id:')
-                print('- {} - {}'.format(article['source_id'], article['title']))
-                print('- problem link: {}'.format(parsed_link.path))
-                print('Exiting.\n')
-                exit()
+            articles.append(article)
+        deliverable['articles'] = articles
+        deliverable['images'] = [image for image in deliverable['images'] if image['key'] not in later_images]
+        later_articles.update((article['locale'], article['source_id']) for article in articles)
+        later_images.update(image['key'] for image in deliverable['images'])
+    deliverables[0]['images'] = [image for deliverable in deliverables for image in deliverable['images']]
+    for deliverable in deliverables[1:]:
+        deliverable['images'] = []
+        deliverable['images_from'] = deliverables[0]     # checked for images that failed to upload
+    for deliverable in deliverables:
+        deliverable['batch'] = ([(article['locale'], article['source_id']) for other in deliverables
+                                 if other is not deliverable for article in other['articles']],
+                                [(image['locale'], image['name']) for other in deliverables
+                                 if other is not deliverable for image in other['images']])
+
+
+def prepare_articles(deliverable, workers=None):
+    """
+    Parses and relinks the articles of a deliverable and splits them into title and body, in a pool of processes.
+    Articles are read only as fast as they're consumed, with at most in_flight articles in memory.
+    :param deliverable: Dict returned by get_deliverable()
+    :param workers: Number of processes. Optional. Default is parse_workers in settings.ini
+    :return: Generator of the dicts returned by prepare_article(), in file order
+    """
+    import modules.engine as engine
+    import modules.relink as relink
+
+    article_files = deliverable['articles']
+    relinker = relink.get_relinker(get_context())
+    batch_articles, batch_images = deliverable.get('batch', ([], []))    # content of the other handoffs of a batch
+    relinker.add_localized_content([(article['locale'], article['source_id']) for article in article_files] +
+                                   batch_articles,
+                                   [(image['locale'], image['name']) for image in deliverable['images']] + batch_images)
+    initargs = (engine.get_engine().name, relinker.localized_articles, relinker.localized_images)
+    if workers is None:
+        workers = int(helpers.get_setting('PUBLISH', 'parse_workers')) or os.cpu_count() or 1
+    workers = min(workers, len(article_files)) or 1
+    in_flight = max(int(helpers.get_setting('PUBLISH', 'in_flight')), workers)
+    if workers == 1:
+        init_article_worker(*initargs)
+        yield from map(prepare_article, article_files)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_article_worker, initargs=initargs) as executor:
+            yield from helpers.bounded_map(executor, prepare_article, article_files, in_flight)
+
+
+def init_article_worker(engine_name, localized_articles, localized_images):
+    """
+    Sets up a process that prepares deliverable articles with prepare_article().
+    :param engine_name: Name of the HTML engine, such as 'lxml'
+    :param localized_articles: Dict of {article_id: set of locales}, including the articles of the deliverable
+    :param localized_images: Dict of {image_name: set of locales}, including the images of the deliverable
+    :return: None
+    """
+    import modules.engine as engine
+    import modules.relink as relink
 
-            if int(article_id) in localized_content[locale]['articles']:
-                link['href'] = re.sub(r'hc/en-us', 'hc/{}'.format(locale), link['href'])
-                # print(' - updated xref - {}'.format(link['href']))
+    global _relinker
+    _relinker = relink.Relinker(localized_articles, localized_images)
+    _relinker.engine = engine.get_engine(engine_name)
 
-        imgs = tree.find_all('img', src=re.compile('/docs/en/'))
-        for link in imgs:
-            image_name = link['src'].split('/docs/en/')[1]
-            if image_name in localized_content[locale]['images']:
-                if locale == 'pt-br':
-                    link['src'] = re.sub(r'docs/en', 'docs/{}'.format('pt'), link['src'])
-                else:
-                    link['src'] = re.sub(r'docs/en', 'docs/{}'.format(locale), link['src'])
-                # print(' - updated src  - {}'.format(link['src']))
 
-        article['tree'] = tree
+def prepare_article(article_file):
+    """
+    Parses a translated article, points its links and images to the localized ones, and splits it into title and
+    body. Runs in the processes set up by init_article_worker().
+    :param article_file: Dict with the locale, hc, source_id, and path of the article file
+    :return: Dict with the locale, hc, source_id, title, body, images, bad_links, and parse_seconds of the article, or
+    None if it's empty. images lists the localized images the article uses
+    """
+    html_engine = _relinker.engine
+    start = time.perf_counter()
+    tree = html_engine.parse_file(article_file['path'])
+    parse_seconds = time.perf_counter() - start
+    if tree is None:
+        return None
+    _relinker.bad_links = []
+    images = _relinker.relink(tree, article_file['locale'], article_file['source_id'])
+    title = html_engine.pop_title(tree)
+    return {'locale': article_file['locale'], 'hc': article_file['hc'], 'source_id': article_file['source_id'],
+            'title': title, 'body': html_engine.serialize(tree), 'images': images,
+            'bad_links': _relinker.bad_links, 'parse_seconds': parse_seconds}
+
 
+def register_new_localized_content(deliverable):
+    print('\nRegistering new localized content...')
+    articles = [(article['locale'], int(article['source_id']))
+                for article in deliverable['published'] + deliverable['unchanged']]
+    failed = set(deliverable['failed_images'])
+    images = [(image['locale'], image['name']) for image in deliverable['images']
+              if (image['locale'], image['name']) not in failed]
+    get_context().add_localized_content(articles, images)
+
+
+def upload_images(deliverable, executor, publish_journal):
+    """
+    Starts uploading the images of a deliverable to S3. Images identical to the ones on S3 or already in the journal
+    are skipped. Uploaded images are added to the journal.
+    :param deliverable: Dict returned by get_deliverable()
+    :param executor: ThreadPoolExecutor object that uploads the images
+    :param publish_journal: Journal object of the handoff
+    :return: Dict of {(locale, image_name): future}. Each future's result is 'uploaded', 'skipped' if the image was
+    already on S3, or 'failed'
+    """
+    import modules.aws as aws
 
-def upload_images(deliverable):
     print('\nUploading images...')
-    bucket_name = helpers.get_aws_setting('bucket_name')
-    bucket = aws.get_s3_bucket(bucket_name)
-    for image in deliverable['images']:
+    config = aws.get_transfer_config(int(helpers.get_aws_setting('multipart_threshold_mb')) * 1024 * 1024,
+                                     int(helpers.get_aws_setting('multipart_chunksize_mb')) * 1024 * 1024,
+                                     int(helpers.get_aws_setting('max_concurrency')))
+    bucket = get_context().bucket
+    prefixes = sorted({image['key'].rsplit('/', 1)[0] + '/' for image in deliverable['images']})
+    key_index = get_context().get_key_index(prefixes)
+
+    def upload(image):
+        etag = aws.get_local_etag(image['path'], config)
+        if publish_journal.has_image(image['key'], etag):
+            return 'skipped'
+        remote = key_index.get(image['key'])
+        if remote and remote['etag'] == etag:
+            publish_journal.add_image(image['key'], etag)
+            return 'skipped'
         print(' - uploading {}'.format(image['key']))
-        response = aws.upload_image(bucket, image['path'], image['key'])
-        if response == 'error':
-            continue
+        if aws.upload_image(bucket, image['path'], image['key'], config) == 'error':
+            return 'failed'
+        publish_journal.add_image(image['key'], etag)
+        key_index[image['key']] = {'size': os.path.getsize(str(image['path'])), 'etag': etag,
+                                   'last_modified': datetime.now(timezone.utc)}
+        return 'uploaded'
 
+    return {(image['locale'], image['name']): executor.submit(upload, image) for image in deliverable['images']}
 
-def upload_articles(deliverable):
-    print('\nUploading articles...')
-    for article in deliverable['articles']:
-        article_id = article['source_id']
-        locale = article['locale']
-        print(f' - uploading {locale} translation of {article_id}')
-        if article_id == 203661746:  # if glossary, paste in HC by hand
-            print(' - warning! glossary, 203661746, skipped. Enter manually.')
-            continue
-        tree = article['tree']
-        title = ' '.join(tree.h1.stripped_strings)
-        tree.h1.decompose()
-        http_method = helpers.get_http_method(article_id, locale, article['hc'])
-        root = 'https://{}.zendesk.com/api/v2/help_center'.format(article['hc'])
-        if http_method == 'post':
-            data = {'translation': {'locale': locale, 'title': title, 'body': str(tree), 'draft': False}}
-            url = root + '/articles/{}/translations.json'.format(article_id)
-            api.post_resource(url, data)
-        else:
-            data = {'translation': {'title': title, 'body': str(tree), 'draft': False}}
-            url = root + '/articles/{}/translations/{}.json'.format(article_id, locale)
-            api.put_resource(url, data)
-        article['title'] = title
+
+def upload_article(article):
+    """
+    Uploads a prepared article to Help Center as a translation.
+    :param article: Dict returned by prepare_article()
+    :return: Dict with the locale, hc, source_id, and title of the article, or None if it wasn't uploaded
+    """
+    article_id = article['source_id']
+    locale = article['locale']
+    print(f' - uploading {locale} translation of {article_id}')
+    if article_id == 203661746:  # if glossary, paste in HC by hand
+        print(' - warning! glossary, 203661746, skipped. Enter manually.')
+        return None
+    title = article['title']
+    body = article['body']
+    http_method = helpers.get_http_method(article_id, locale, article['hc'])
+    root = helpers.get_hc_root(article['hc'])
+    if http_method == 'post':
+        data = {'translation': {'locale': locale, 'title': title, 'body': body, 'draft': False}}
+        url = root + '/articles/{}/translations.json'.format(article_id)
+        result = api.post_resource(url, data)
+        if result is not False:
+            helpers.remove_missing_locale(article_id, article['hc'], locale)
+    else:
+        data = {'translation': {'title': title, 'body': body, 'draft': False}}
+        url = root + '/articles/{}/translations/{}.json'.format(article_id, locale)
+        result = api.put_resource(url, data)
+    if result is False:
+        return None
+    return {'locale': locale, 'hc': article['hc'], 'source_id': article_id, 'title': title}
+
+
+def get_translation_hash(title, body):
+    """
+    :param title: Title of a translation
+    :param body: Body of the translation
+    :return: Hash of the title and body with the whitespace collapsed
+    """
+    return journal.get_hash(' '.join(title.split()) + '\n' + ' '.join((body or '').split()))
+
+
+def is_live(article, translation_hash):
+    """
+    Checks whether Help Center already has a translation of an article with the same title and body.
+    :param article: Dict returned by prepare_article()
+    :param translation_hash: Hash of the article returned by get_translation_hash()
+    :return: True if the live translation is the same
+    """
+    if article['locale'] in helpers.get_missing_locales(article['source_id'], article['hc']):
+        return False
+    url = helpers.get_hc_root(article['hc']) + '/articles/{}/translations/{}.json'.format(article['source_id'],
+                                                                                           article['locale'])
+    live = api.get_resource(url)
+    if not live:
+        return False
+    return get_translation_hash(live['title'], live['body']) == translation_hash
+
+
+def publish_deliverable(deliverable, workers=None, resume=False, verify_live=False):
+    """
+    Uploads the images of a deliverable to S3 while its articles are prepared and uploaded to Help Center. Each
+    service has its own pool of threads. An article is uploaded only after the localized images it uses are on S3,
+    and not at all if one of them failed to upload, here or with the first deliverable of a batch. The failed images
+    are added to the failed_images of the deliverable. Articles with bad links aren't uploaded. They're added to the
+    bad_links of the deliverable instead.
+    Each upload is recorded in the publish journal of the handoff as it succeeds, and the hash of each published
+    translation in the handoffs database. Translations with the same title and body as the last ones published
+    are skipped.
+    :param deliverable: Dict returned by get_deliverable(). The uploaded articles are added to its published list,
+    the skipped unchanged ones to its unchanged list so they're still registered as localized
+    :param workers: Number of processes preparing articles. Optional. Default is parse_workers in settings.ini
+    :param resume: If True, skips the images and articles recorded in the journal by earlier runs
+    :param verify_live: If True, compares each translation with the live one in Help Center instead of the hash
+    recorded when it was last published
+    :return: None
+    """
+    image_workers = int(helpers.get_aws_setting('upload_workers'))
+    article_workers = int(helpers.get_setting('PUBLISH', 'upload_workers'))
+    in_flight = int(helpers.get_setting('PUBLISH', 'in_flight'))
+    metrics = get_metrics()
+    batch_failures = set(deliverable['images_from']['failed_images']) if 'images_from' in deliverable else set()
+    publish_journal = journal.Journal(deliverable['path'].parent / 'publish_journal.jsonl', resume)
+    store = get_context().store
+    published_hashes = store.get_translation_hashes()
+    resumed = 0
+    unchanged = 0
+    image_failures = 0
+
+    with ThreadPoolExecutor(max_workers=max(image_workers, 1)) as image_executor, \
+            ThreadPoolExecutor(max_workers=max(article_workers, 1)) as article_executor:
+        image_uploads = upload_images(deliverable, image_executor, publish_journal)
+
+        def upload(article):
+            body_hash = journal.get_hash(article['body'])
+            if publish_journal.has_article(article['source_id'], article['locale'], body_hash):
+                return 'resumed', {'locale': article['locale'], 'hc': article['hc'],
+                                   'source_id': article['source_id'], 'title': article['title']}
+            translation_hash = get_translation_hash(article['title'], article['body'])
+            key = (article['hc'], int(article['source_id']), article['locale'])
+            if verify_live:
+                same = is_live(article, translation_hash)
+            else:
+                same = published_hashes.get(key) == translation_hash
+            if same:
+                print(f' - {article["locale"]} translation of {article["source_id"]} unchanged. Skipping.')
+                if published_hashes.get(key) != translation_hash:
+                    store.save_translation_hash(*key, translation_hash)
+                publish_journal.add_article(article['source_id'], article['locale'], body_hash)
+                return 'unchanged', {'locale': article['locale'], 'hc': article['hc'],
+                                     'source_id': article['source_id'], 'title': article['title']}
+            failed = [name for name in article['images'] if (article['locale'], name) in batch_failures
+                      or (article['locale'], name) in image_uploads
+                      and image_uploads[(article['locale'], name)].result() == 'failed']
+            if failed:
+                print(f' - skipping {article["locale"]} translation of {article["source_id"]}: '
+                      f'images failed to upload ({", ".join(failed)})')
+                return 'failed', None
+            published = upload_article(article)
+            if published is not None:
+                publish_journal.add_article(article['source_id'], article['locale'], body_hash)
+                store.save_translation_hash(*key, translation_hash)
+            return 'uploaded', published
+
+        def get_uploadable(articles):
+            for article in articles:
+                if article is None:
+                    continue
+                metrics.add_parse(article['parse_seconds'])
+                if article['bad_links']:
+                    deliverable['bad_links'].extend(article['bad_links'])
+                    print(f' - skipping {article["locale"]} translation of {article["source_id"]}: '
+                          'links without an article id')
+                    continue
+                yield article
+
+        print('\nUploading articles...')
+        articles = get_uploadable(prepare_articles(deliverable, workers))
+        for status, published in helpers.bounded_map(article_executor, upload, articles,
+                                                     max(in_flight, article_workers)):
+            if status == 'unchanged':
+                deliverable['unchanged'].append(published)
+                unchanged += 1
+            elif published is not None:
+                deliverable['published'].append(published)
+            if status == 'resumed':
+                resumed += 1
+            elif status == 'failed':
+                image_failures += 1
+
+    publish_journal.close()
+    if resume:
+        print(' - skipped {} articles published by an earlier run'.format(resumed))
+    print(' - skipped {} translations unchanged since they were last published'.format(unchanged))
+    results = {key: image_upload.result() for key, image_upload in image_uploads.items()}
+    deliverable['failed_images'] = [key for key, result in results.items() if result == 'failed']
+    print(' - skipped {} unchanged images'.format(list(results.values()).count('skipped')))
+    if deliverable['failed_images']:
+        print(' - {} images failed to upload. The {} translations using them were not published. Publish them '
+              'again with --subset.'.format(len(deliverable['failed_images']), image_failures))
+
+
+def print_bad_links(deliverable):
+    """
+    Prints the links without an article id found while publishing. The articles containing them weren't published.
+    :param deliverable: Dict returned by get_deliverable()
+    :return: None
+    """
+    import modules.relink as relink
+
+    if relink.print_bad_links(deliverable['bad_links']):
+        print('These articles were not published. Fix the links, then publish them with --subset.\n')
 
 
 def print_publish_email(deliverable, handoff_name):
+    import arrow
+
     utc = arrow.utcnow()
     local = utc.to('US/Pacific')
     date = local.format('YYYY-MM-DD')
     published_articles = ''
-    for article in deliverable['articles']:
+    for article in deliverable['published']:
         if str(article['source_id']) in published_articles:
             continue
         published_articles += '{} - {}\n'.format(article['hc'].capitalize(), article['source_id'])
@@ -1,9 +1,36 @@
 import json
-import configparser
+import time
+import threading
+from collections import deque
 from pathlib import Path
 
-from bs4 import BeautifulSoup, Comment
-from modules.api import get_resource_list
+from modules.metrics import get_metrics
+
+_missing_locales = {}
+_missing_locales_lock = threading.Lock()
+
+# Help Center locales whose images are stored under a different S3 folder
+S3_LOCALES = {'pt-br': 'pt'}
+
+
+def get_setting(section, name, required=True):
+    """
+    Gets a setting from the settings.ini file loaded for the run.
+    :param section: Section name, such as 'AWS'
+    :param name: One of the variable names in the section
+    :param required: If True, exits if the section or variable doesn't exist
+    :return: String, or None if the setting isn't required and doesn't exist
+    """
+    from modules.context import get_context     # not at the top: modules.context imports this module
+
+    config = get_context().config
+    try:
+        return config[section][name]
+    except KeyError:
+        if required:
+            print(f'\'{name}\' is not a valid setting in the {section} section of settings.ini. Exiting.')
+            exit()
+        return None
 
 
 def get_path_setting(name=''):
@@ -12,14 +39,7 @@ def get_path_setting(name=''):
     :param name: One of the variable names in the FILES section of settings.ini
     :return: Path object from the pathlib library
     """
-    config = configparser.ConfigParser()
-    config.read('settings.ini')
-    try:
-        config['PATHS'][name]
-    except KeyError:
-        print(f'\'{name}\' is not a valid argument for get_path(). Exiting.')
-        exit()
-    path = Path(config['PATHS'][name])
+    path = Path(get_setting('PATHS', name))
     if path.exists():
         return path
     else:
@@ -33,21 +53,51 @@ def get_aws_setting(name=''):
     :param name: One of the variable names in the AWS section of settings.ini
     :return: String
     """
-    config = configparser.ConfigParser()
-    config.read('settings.ini')
-    try:
-        config['AWS'][name]
-    except KeyError:
-        print(f'\'{name}\' is not a valid argument for get_aws_path(). Exiting.')
-        exit()
-    return config['AWS'][name]
+    return get_setting('AWS', name)
+
+
+def get_hc_root(hc):
+    """
+    Gets the root url of the Help Center API. The hc_root setting in the HTTP section of settings.ini can point it to
+    another server, such as a local stand-in.
+    :param hc: Help Center subdomain, such as 'support'
+    :return: String, such as 'https://support.zendesk.com/api/v2/help_center'
+    """
+    root = get_setting('HTTP', 'hc_root', required=False) or 'https://{hc}.zendesk.com/api/v2/help_center'
+    return root.format(hc=hc)
+
+
+def get_s3_locale(locale):
+    """
+    :param locale: Help Center locale, such as 'de' or 'pt-br'
+    :return: Name of the locale's folder in the docs folder on S3, such as 'de' or 'pt'
+    """
+    return S3_LOCALES.get(locale, locale)
 
 
 def get_image_skip_list():
-    skip_list_path = get_path_setting('data') / 'image_skip_list.txt'
-    with skip_list_path.open() as f:
-        skip_list = f.read().splitlines()
-    return skip_list
+    from modules.context import get_context
+
+    return get_context().image_skip_list
+
+
+def bounded_map(executor, function, iterable, limit):
+    """
+    Like executor.map, but only reads as many items from iterable as needed to keep limit calls in progress, so
+    results are produced as fast as they're consumed.
+    :param executor: ThreadPoolExecutor or ProcessPoolExecutor object
+    :param function: Function to call with each item
+    :param iterable: Items. Can be a generator
+    :param limit: Maximum number of calls submitted but not yet consumed
+    :return: Generator of the results, in the order of the items
+    """
+    pending = deque()
+    for item in iterable:
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+        pending.append(executor.submit(function, item))
+    while pending:
+        yield pending.popleft().result()
 
 
 def write_json(file, data):
@@ -62,51 +112,52 @@ def read_json(file):
 
 def create_tree_from_api(response):
     """
-    Returns a BeautifulSoup tree object from the HTML returned by the HC API
+    Returns a tree object from the HTML returned by the HC API, parsed with the engine specified in settings.ini
     :param response: Response from the Articles API containing the article. Converted to Dict from JSON
     :return: A tree object
     """
-    body = '<html>' + response['body'] + '</html>'  # to parse all the file (prevent `<p> </p>` None-type errors)
-    tree = BeautifulSoup(body, 'lxml')
-    if tree.html is None or tree.body is None:
+    import modules.engine as engine
+
+    start = time.perf_counter()
+    tree = engine.get_engine().parse_article(response['body'], response['title'])
+    get_metrics().add_parse(time.perf_counter() - start)
+    if tree is None:
         print('{}: tree.html or tree.body is None'.format(response['id']))
         return None
-    comments = tree.find_all(text=lambda text: isinstance(text, Comment))
-    [comment.extract() for comment in comments]
-    head = tree.new_tag('head')
-    meta = tree.new_tag('meta')
-    meta['charset'] = 'utf-8'
-    head.append(meta)
-    tree.body.insert_before(head)
-    h1 = tree.new_tag('h1')
-    h1.string = response['title']
-    tree.body.insert(0, h1)
     return tree
 
 
 def create_tree_from_file(path):
-    html = path.read_text(encoding='utf-8')
-    tree = BeautifulSoup(html, 'lxml')
+    import modules.engine as engine
+
+    start = time.perf_counter()
+    tree = engine.get_engine().parse_file(path)
+    get_metrics().add_parse(time.perf_counter() - start)
     return tree
 
 
 def get_article_markup(tree):
     """
     Builds HTML markup from parsed tree to write to file, and strips any HTML comments.
-    :param tree: A BeautifulSoup tree object
+    :param tree: A tree object
     :return: String
     """
+    import modules.engine as engine
+
     xml = '<?xml version="1.0" encoding="UTF-8"?>\n'
-    markup = xml + str(tree)
+    markup = xml + engine.get_engine().serialize(tree)
     return markup
 
 
 def get_article_images(tree):
+    import modules.engine as engine
+
     article_images = []
     image_skip_list = get_image_skip_list()
-    images = tree.find_all('img')
+    html_engine = engine.get_engine()
+    images = html_engine.find_elements(tree, 'img', 'src')
     for image in images:
-        image_url = Path(image['src'])
+        image_url = Path(html_engine.get_attribute(image, 'src'))
         if 'zen-marketing-documentation.s3.amazonaws.com/docs/' not in str(image_url):
             continue
         if image_url.name in image_skip_list:
@@ -130,6 +181,43 @@ def get_article_image_names(handoff_name, handoff_manifest, article_list):
     return image_names
 
 
+def get_missing_locales(article_id, hc):
+    """
+    Gets the locales the article has no translation in. Fetched once per article per run.
+    :param article_id:
+    :param hc:
+    :return: Frozenset of locales
+    """
+    from modules.api import get_resource_list
+
+    cache_key = (hc, int(article_id))
+    if cache_key not in _missing_locales:
+        root = get_hc_root(hc)
+        url = root + '/articles/{}/translations/missing.json'.format(article_id)
+        response = get_resource_list(url, list_name='locales', paginate=False)
+        if response is False:
+            print('\nError getting missing translations for {}. Exiting.'.format(article_id))
+            exit()
+        with _missing_locales_lock:
+            _missing_locales.setdefault(cache_key, frozenset(response))
+    return _missing_locales[cache_key]
+
+
+def remove_missing_locale(article_id, hc, locale):
+    """
+    Records that the article now has a translation in a locale, so later uploads of it in the same run update the
+    translation instead of creating it again.
+    :param article_id: Article id
+    :param hc: Help Center subdomain
+    :param locale: Locale of the translation just created
+    :return: None
+    """
+    cache_key = (hc, int(article_id))
+    with _missing_locales_lock:
+        if cache_key in _missing_locales:
+            _missing_locales[cache_key] = _missing_locales[cache_key] - {locale}
+
+
 def get_http_method(article_id, article_locale, hc):
     """
     Check if any missing translations of the article exist. Use post for them, otherwise put.
@@ -138,14 +226,7 @@ def get_http_method(article_id, article_locale, hc):
     :param hc:
     :return:
     """
-    root = 'https://{}.zendesk.com/api/v2/help_center'.format(hc)
-    url = root + '/articles/{}/translations/missing.json'.format(article_id)
-    response = get_resource_list(url, list_name='locales', paginate=False)
-    if response is False:
-        print('\nError getting missing translations for {}. Exiting.'.format(article_id))
-        exit()
-    missing_translations = response
-    if article_locale in missing_translations:  # get http method to use for article
+    if article_locale in get_missing_locales(article_id, hc):  # get http method to use for article
         return 'post'
     else:
         return 'put'
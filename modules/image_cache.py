@@ -0,0 +1,120 @@
+import os
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+import modules.aws as aws
+import modules.helpers as helpers
+
+
+class ImageCache:
+    """
+    Local copy of the images downloaded from S3, shared by every handoff. Files are named after the S3 key and ETag
+    of the image, so a changed image is downloaded again. When the cache grows past its maximum size, the least
+    recently used images are deleted.
+    """
+
+    def __init__(self, path, max_size):
+        """
+        :param path: Path of the cache folder. Created if it doesn't exist
+        :param max_size: Maximum size of the cache, in bytes
+        """
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.files = OrderedDict()      # {file name: size}, least recently used first
+        self.size = 0
+        self.path.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for entry in os.scandir(str(self.path)):
+            if entry.is_file() and not entry.name.endswith('.part'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self.files[name] = size
+            self.size += size
+
+    def fetch(self, bucket, key, etag):
+        """
+        Returns the cached copy of an image, downloading it from S3 if the cache doesn't have it.
+        :param bucket: S3 bucket object
+        :param key: S3 key of the image. Example: 'docs/en/doggo.png'
+        :param etag: ETag of the image in S3, as returned by aws.get_key_index()
+        :return: Path of the cached image, or None if the download failed
+        """
+        name = get_file_name(key, etag)
+        image_path = self.path / name
+        with self.lock:
+            if name in self.files:
+                if image_path.exists():
+                    self.files.move_to_end(name)
+                    os.utime(str(image_path))
+                    return image_path
+                self.size -= self.files.pop(name)      # deleted outside the tool
+        part_path = self.path / (name + '.part')
+        if aws.download_image(bucket, key, part_path) == 'error':
+            if part_path.exists():
+                part_path.unlink()
+            return None
+        os.replace(str(part_path), str(image_path))
+        with self.lock:
+            size = image_path.stat().st_size
+            self.size += size - self.files.pop(name, 0)
+            self.files[name] = size
+            self.evict(keep=name)
+        return image_path
+
+    def evict(self, keep):
+        """
+        Deletes the least recently used images until the cache fits in its maximum size. Called with the lock held.
+        :param keep: File name of the image just added, never deleted
+        :return: None
+        """
+        while self.size > self.max_size and len(self.files) > 1:
+            name = next(iter(self.files))
+            if name == keep:
+                break
+            self.size -= self.files.pop(name)
+            try:
+                (self.path / name).unlink()
+            except FileNotFoundError:
+                pass
+
+
+def get_file_name(key, etag):
+    """
+    :param key: S3 key of the image
+    :param etag: ETag of the image
+    :return: Cache file name, a hash of the key and ETag followed by the image extension
+    """
+    digest = hashlib.sha256('{}\n{}'.format(key, etag).encode('utf-8')).hexdigest()
+    return digest + Path(key).suffix.lower()
+
+
+def place_image(source, destination):
+    """
+    Puts a copy of a cached image in a handoff folder. Uses a hard link if the folders are on the same drive,
+    otherwise copies the file.
+    :param source: Path of the cached image
+    :param destination: Path of the image in the handoff folder
+    :return: None
+    """
+    if destination.exists():
+        destination.unlink()
+    try:
+        os.link(str(source), str(destination))
+    except OSError:
+        shutil.copyfile(str(source), str(destination))
+
+
+def get_image_cache():
+    """
+    Returns the image cache specified in the CACHE section of settings.ini.
+    :return: ImageCache object, or None if the cache is disabled
+    """
+    if helpers.get_setting('CACHE', 'enabled').lower() not in ('yes', 'true', '1'):
+        return None
+    max_size = int(helpers.get_setting('CACHE', 'max_size_mb')) * 1024 * 1024
+    return ImageCache(Path(helpers.get_setting('CACHE', 'path')), max_size)
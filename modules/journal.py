@@ -0,0 +1,71 @@
+import json
+import hashlib
+import threading
+
+
+class Journal:
+    """
+    Record of the images and articles of a handoff published so far, appended to as each upload succeeds. Lets a
+    publish that stopped partway resume without uploading the same content again.
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        :param path: Path of the journal file, a JSON object per line
+        :param resume: If True, keeps the records of earlier runs. Otherwise the journal starts empty
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.images = {}
+        self.articles = {}
+        if resume and path.exists():
+            with path.open(encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:      # last line cut short when the previous run stopped
+                        continue
+                    if 'image' in record:
+                        self.images[record['image']] = record['etag']
+                    elif 'article' in record:
+                        self.articles[(record['article'], record['locale'])] = record['hash']
+        self.file = path.open('a' if resume else 'w', encoding='utf-8')
+
+    def has_image(self, key, etag):
+        """
+        :param key: S3 key of the image
+        :param etag: ETag of the local image file
+        :return: True if the same image was uploaded to the key
+        """
+        return self.images.get(key) == etag
+
+    def has_article(self, source_id, locale, body_hash):
+        """
+        :param source_id: Article id
+        :param locale: Locale of the translation
+        :param body_hash: Hash of the translation body returned by get_hash()
+        :return: True if the same translation was uploaded
+        """
+        return self.articles.get((str(source_id), locale)) == body_hash
+
+    def add_image(self, key, etag):
+        self.write({'image': key, 'etag': etag})
+
+    def add_article(self, source_id, locale, body_hash):
+        self.write({'article': str(source_id), 'locale': locale, 'hash': body_hash})
+
+    def write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def get_hash(text):
+    """
+    :param text: String, such as an article body
+    :return: SHA-256 hex digest of the text
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
@@ -0,0 +1,147 @@
+import re
+import json
+import time
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+ID_RE = re.compile(r'/\d+')
+LOCALE_RE = re.compile(r'/translations/(?!missing)[\w-]+\.json$')
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+class Metrics:
+    """
+    Timings and counts collected during a run: stage wall times, Help Center requests, rate-limit waits, S3
+    operations, and HTML parsing. Nothing is recorded unless enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.requests = {}
+        self.waits = {}
+        self.s3 = {}
+        self.parse = {'count': 0, 'seconds': 0.0}
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Records the wall time of the code in a with block as a stage of the run.
+        :param name: Stage name, such as 'download'
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                with self.lock:
+                    self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def add_request(self, method, url, status, seconds):
+        """
+        :param method: HTTP method, such as 'GET'
+        :param url: Endpoint url
+        :param status: Status code of the response, or None if the connection failed
+        :param seconds: Time the request took
+        """
+        if not self.enabled:
+            return
+        parsed_url = urlparse(url)
+        key = '{} {} {}'.format(parsed_url.netloc, method, get_endpoint(parsed_url.path))
+        with self.lock:
+            entry = self.requests.setdefault(key, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'statuses': {}})
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            status = str(status or 'failed')
+            entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+
+    def add_wait(self, hc, reason, seconds):
+        """
+        :param hc: Help Center subdomain
+        :param reason: 'throttle' for the rate limiter, '429' for Retry-After and backoff waits, 'retry' for the others
+        :param seconds: Time spent waiting
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            entry = self.waits.setdefault(hc, {}).setdefault(reason, {'count': 0, 'seconds': 0.0})
+            entry['count'] += 1
+            entry['seconds'] += seconds
+
+    def add_s3(self, operation, size, seconds):
+        """
+        :param operation: S3 operation, such as 'download' or 'upload'
+        :param size: Bytes transferred
+        :param seconds: Time the operation took
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            entry = self.s3.setdefault(operation, {'count': 0, 'bytes': 0, 'seconds': 0.0})
+            entry['count'] += 1
+            entry['bytes'] += size
+            entry['seconds'] += seconds
+
+    def add_parse(self, seconds, count=1):
+        """
+        :param seconds: Time spent parsing HTML
+        :param count: Number of documents parsed
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.parse['count'] += count
+            self.parse['seconds'] += seconds
+
+    def get_report(self, command):
+        with self.lock:
+            return {'command': command,
+                    'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                    'seconds': round(time.time() - self.started, 3),
+                    'stages': {name: round(seconds, 3) for name, seconds in self.stages.items()},
+                    'requests': self.requests,
+                    'waits': self.waits,
+                    's3': self.s3,
+                    'parse': self.parse}
+
+    def write_report(self, folder, command):
+        """
+        Writes the metrics of the run to a JSON file.
+        :param folder: Path of the folder to write the report to, such as the handoff folder
+        :param command: Name of the zlo.py command, such as 'create'
+        :return: Path of the report
+        """
+        path = folder / 'metrics_{}_{}.json'.format(command, time.strftime('%Y%m%d-%H%M%S',
+                                                                            time.localtime(self.started)))
+        path.write_text(json.dumps(self.get_report(command), indent=2), encoding='utf-8')
+        return path
+
+
+def get_endpoint(path):
+    """
+    :param path: Url path, such as '/api/v2/help_center/articles/123/translations/de.json'
+    :return: Path with the ids and locales replaced, such as '.../articles/{id}/translations/{locale}.json'
+    """
+    return LOCALE_RE.sub('/translations/{locale}.json', ID_RE.sub('/{id}', path))
+
+
+def get_metrics():
+    """
+    Returns the metrics of the current run, creating them on first use.
+    :return: Metrics object
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
@@ -0,0 +1,114 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+import modules.api as api
+import modules.helpers as helpers
+
+
+class ArticleMirror:
+    """
+    Local copy of the Help Center articles, kept current with the incremental articles export. Each Help Center has
+    its own start_time cursor so a sync only downloads the articles updated since the last one.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the SQLite database file. Created if it doesn't exist
+        """
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.lock = threading.Lock()
+        self.synced = set()
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS articles (hc TEXT, id INTEGER, section_id INTEGER, '
+                                    'updated_at TEXT, data TEXT, PRIMARY KEY (hc, id))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS cursors (hc TEXT PRIMARY KEY, start_time INTEGER)')
+
+    def sync(self, hc):
+        """
+        Downloads the articles updated in a Help Center since the last sync. Only syncs once per run.
+        :param hc: Help Center subdomain, such as 'support'
+        :return: True if the mirror is current, otherwise False
+        """
+        if hc in self.synced:
+            return True
+        with self.lock:
+            row = self.connection.execute('SELECT start_time FROM cursors WHERE hc = ?', (hc,)).fetchone()
+        start_time = row[0] if row else 0
+        print(f'\nSyncing the {hc} article mirror')
+        root = helpers.get_hc_root(hc)
+        url = root + '/incremental/articles.json?start_time={}'.format(start_time)
+        client = api.get_client()
+        count = 0
+        while url:
+            response = client.get(url)
+            if response is None or response.status_code != 200:
+                print('- sync failed. Using the API for {} articles.'.format(hc))
+                return False
+            data = response.json()
+            self.put_articles(hc, data['articles'])
+            count += len(data['articles'])
+            end_time = data.get('end_time') or start_time
+            with self.lock, self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO cursors (hc, start_time) VALUES (?, ?)',
+                                        (hc, end_time))
+            url = data['next_page'] if end_time != start_time else None
+            start_time = end_time
+        print('- {} updated articles'.format(count))
+        self.synced.add(hc)
+        return True
+
+    def put_articles(self, hc, articles):
+        """
+        Stores articles in the mirror, replacing any older copies.
+        :param hc: Help Center subdomain
+        :param articles: List of articles as returned by the API
+        :return: None
+        """
+        rows = [(hc, a['id'], a['section_id'], a['updated_at'], json.dumps(a)) for a in articles]
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO articles (hc, id, section_id, updated_at, data) '
+                                        'VALUES (?, ?, ?, ?, ?)', rows)
+
+    def get_article(self, hc, article_id):
+        """
+        Returns an article from the mirror if the Help Center was synced in this run.
+        :param hc: Help Center subdomain
+        :param article_id: Article id
+        :return: Dict of the article, or None if the mirror has no fresh copy
+        """
+        if hc not in self.synced:
+            return None
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM articles WHERE hc = ? AND id = ?',
+                                          (hc, article_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_section_articles(self, hc, section_ids):
+        """
+        Returns the published articles of the specified sections.
+        :param hc: Help Center subdomain
+        :param section_ids: List of section ids
+        :return: List of article dicts, in section order
+        """
+        articles = []
+        for section_id in section_ids:
+            with self.lock:
+                rows = self.connection.execute('SELECT data FROM articles WHERE hc = ? AND section_id = ? '
+                                               'ORDER BY id', (hc, section_id)).fetchall()
+            for row in rows:
+                article = json.loads(row[0])
+                if not article.get('draft'):
+                    articles.append(article)
+        return articles
+
+
+def get_mirror():
+    """
+    Returns the article mirror specified in the MIRROR section of settings.ini.
+    :return: ArticleMirror object, or None if the mirror is disabled
+    """
+    if helpers.get_setting('MIRROR', 'enabled').lower() not in ('yes', 'true', '1'):
+        return None
+    return ArticleMirror(Path(helpers.get_setting('MIRROR', 'path')))
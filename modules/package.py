@@ -0,0 +1,113 @@
+import time
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')  # already compressed
+ZIP64_LIMIT = 0xFFFFFFFF
+UNIX_HOST = 3 << 8
+FILE_ATTRIBUTES = 0o100644 << 16    # regular file, rw-r--r--
+
+
+class HandoffPackage:
+    """
+    Zip file of a handoff, written in a single pass as the articles and images are produced. Entries are compressed
+    in a pool of threads and written in the order they were added. Images already compressed are stored as is.
+    """
+
+    def __init__(self, path, workers=4, in_flight=16):
+        """
+        :param path: Path of the zip file to create
+        :param workers: Number of threads compressing entries
+        :param in_flight: Maximum number of entries compressed but not yet written
+        """
+        self.path = path
+        self.file = path.open('wb')
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+        self.in_flight = max(in_flight, 1)
+        self.pending = deque()
+        self.entries = []
+        self.offset = 0
+        self.date_time = get_dos_date_time(time.localtime())
+
+    def add(self, name, data):
+        """
+        Adds a file to the package.
+        :param name: Path of the file in the zip, with forward slashes
+        :param data: Bytes of the file
+        :return: None
+        """
+        compress = not name.lower().endswith(STORED_EXTENSIONS)
+        self.pending.append(self.executor.submit(compress_entry, name, data, compress))
+        while self.pending and (self.pending[0].done() or len(self.pending) > self.in_flight):
+            self.write_entry(*self.pending.popleft().result())
+
+    def write_entry(self, name, method, crc, data, size):
+        encoded_name = name.encode('utf-8')
+        time_, date = self.date_time
+        self.file.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x0800, method, time_, date, crc, len(data),
+                                    size, len(encoded_name), 0))
+        self.file.write(encoded_name)
+        self.file.write(data)
+        self.entries.append((encoded_name, method, crc, len(data), size, self.offset))
+        self.offset += 30 + len(encoded_name) + len(data)
+
+    def close(self):
+        """
+        Writes the remaining entries and the central directory, and closes the zip file.
+        :return: None
+        """
+        while self.pending:
+            self.write_entry(*self.pending.popleft().result())
+        self.executor.shutdown()
+        directory_offset = self.offset
+        time_, date = self.date_time
+        for encoded_name, method, crc, compressed_size, size, offset in self.entries:
+            extra = b''
+            if offset > ZIP64_LIMIT:
+                extra = struct.pack('<HHQ', 0x0001, 8, offset)
+                offset = 0xFFFFFFFF
+            version = 45 if extra else 20
+            self.file.write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, UNIX_HOST | version, version, 0x0800, method,
+                                        time_, date, crc, compressed_size, size, len(encoded_name), len(extra), 0, 0,
+                                        0, FILE_ATTRIBUTES, offset))
+            self.file.write(encoded_name)
+            self.file.write(extra)
+        directory_size = self.file.tell() - directory_offset
+        count = len(self.entries)
+        if directory_offset > ZIP64_LIMIT or count > 0xFFFF:
+            zip64_offset = directory_offset + directory_size
+            self.file.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, UNIX_HOST | 45, 45, 0, 0, count, count, directory_size,
+                                        directory_offset))
+            self.file.write(struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1))
+            self.file.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0))
+        else:
+            self.file.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, directory_size,
+                                        directory_offset, 0))
+        self.file.close()
+
+
+def compress_entry(name, data, compress):
+    """
+    Computes the CRC of a file and deflates it, if worth it. Runs in the threads of a HandoffPackage.
+    :return: Tuple of the name, zip compression method, CRC, data to write, and uncompressed size
+    """
+    crc = zlib.crc32(data) & 0xFFFFFFFF
+    if compress:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < len(data):
+            return name, 8, crc, compressed, len(data)
+    return name, 0, crc, data, len(data)
+
+
+def get_dos_date_time(local_time):
+    """
+    :param local_time: time.struct_time object
+    :return: Tuple of the time and date in the MS-DOS format used by zip files
+    """
+    year = max(local_time.tm_year, 1980)
+    dos_time = (local_time.tm_hour << 11) | (local_time.tm_min << 5) | (local_time.tm_sec // 2)
+    dos_date = ((year - 1980) << 9) | (local_time.tm_mon << 5) | local_time.tm_mday
+    return dos_time, dos_date
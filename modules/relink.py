@@ -0,0 +1,92 @@
+import re
+
+import modules.engine as engine
+import modules.helpers as helpers
+
+ARTICLE_HREF_RE = re.compile(r'^[^?#]*?/hc/en-us/articles/([^?#]*)')  # article link in the path of the url
+NON_DIGIT_RE = re.compile('[^0-9]')
+IMAGE_SRC = '/docs/en/'
+
+
+class Relinker:
+    """
+    Rewrites the links and image sources of translated articles to point to the localized articles and images.
+    Built once per publish from the content localized so far.
+    """
+
+    def __init__(self, localized_articles, localized_images):
+        """
+        :param localized_articles: Dict of {article_id: set of locales the article is localized in}
+        :param localized_images: Dict of {image_name: set of locales the image is localized in}
+        """
+        self.localized_articles = localized_articles
+        self.localized_images = localized_images
+        self.engine = engine.get_engine()
+        self.bad_links = []
+
+    def add_localized_content(self, articles=(), images=()):
+        """
+        Adds content to the lookup tables, such as the articles and images of the deliverable being published.
+        :param articles: Iterable of (locale, article_id) tuples
+        :param images: Iterable of (locale, image_name) tuples
+        :return: None
+        """
+        for locale, article_id in articles:
+            self.localized_articles.setdefault(int(article_id), set()).add(locale)
+        for locale, name in images:
+            self.localized_images.setdefault(name, set()).add(locale)
+
+    def relink(self, tree, locale, source_id):
+        """
+        Rewrites the en-us article links and en image sources of a tree in one pass. Links without an article id are
+        recorded in bad_links instead.
+        :param tree: A tree object
+        :param locale: Locale of the translation, such as 'de' or 'pt-br'
+        :param source_id: Id of the article, to report bad links
+        :return: List of the names of the localized images the tree now uses
+        """
+        html_engine = self.engine
+        hc_path = 'hc/{}'.format(locale)
+        docs_path = 'docs/{}'.format(helpers.get_s3_locale(locale))
+        images = []
+        for element, attribute, value in html_engine.find_links(tree):
+            if attribute == 'href':
+                match = ARTICLE_HREF_RE.match(value)
+                if match is None:
+                    continue
+                article_id = NON_DIGIT_RE.sub('', match.group(1).split('-')[0])
+                if not article_id:
+                    self.bad_links.append((source_id, locale, value))
+                    continue
+                if locale in self.localized_articles.get(int(article_id), ()):
+                    html_engine.set_attribute(element, attribute, value.replace('hc/en-us', hc_path))
+            elif IMAGE_SRC in value:
+                image_name = value.split(IMAGE_SRC)[1]
+                if locale in self.localized_images.get(image_name, ()):
+                    html_engine.set_attribute(element, attribute, value.replace('docs/en', docs_path))
+                    images.append(image_name)
+        return images
+
+
+def print_bad_links(bad_links):
+    """
+    Prints links without an article id.
+    :param bad_links: List of (source_id, locale, link) tuples, such as Relinker.bad_links
+    :return: True if there were bad links, otherwise False
+    """
+    if not bad_links:
+        return False
+    print('\nThe following articles contain HC links that do not use an id:')
+    for source_id, locale, link in bad_links:
+        print('- {} ({}) - problem link: {}'.format(source_id, locale, link))
+    return True
+
+
+def get_relinker(context):
+    """
+    Returns a Relinker with the articles and images registered as localized.
+    :param context: RunContext object
+    :return: Relinker object
+    """
+    localized_articles, localized_images = context.get_localized_content()
+    return Relinker(localized_articles, localized_images)
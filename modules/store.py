@@ -0,0 +1,248 @@
+import sqlite3
+import threading
+
+import modules.helpers as helpers
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS handoffs (
+    name TEXT PRIMARY KEY,
+    status TEXT
+);
+CREATE TABLE IF NOT EXISTS manifest (
+    handoff TEXT REFERENCES handoffs (name),
+    position INTEGER,
+    id INTEGER,
+    deferred_id INTEGER,
+    hc TEXT,
+    title TEXT,
+    en_images INTEGER,
+    bump_ok INTEGER,
+    writer,
+    comments TEXT,
+    PRIMARY KEY (handoff, position)
+);
+CREATE INDEX IF NOT EXISTS manifest_id ON manifest (id);
+CREATE TABLE IF NOT EXISTS localized_articles (
+    locale TEXT,
+    article_id INTEGER,
+    PRIMARY KEY (locale, article_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS localized_images (
+    locale TEXT,
+    name TEXT,
+    PRIMARY KEY (locale, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ledger (
+    handoff TEXT,
+    kind TEXT,
+    hc TEXT,
+    name TEXT,
+    hash TEXT,
+    PRIMARY KEY (handoff, kind, hc, name)
+);
+CREATE INDEX IF NOT EXISTS ledger_content ON ledger (kind, hc, name);
+CREATE TABLE IF NOT EXISTS translations (
+    hc TEXT,
+    article_id INTEGER,
+    locale TEXT,
+    hash TEXT,
+    PRIMARY KEY (hc, article_id, locale)
+);
+'''
+
+MANIFEST_FIELDS = ('id', 'deferred_id', 'hc', 'title', 'en_images', 'bump_ok', 'writer', 'comments')
+
+
+class Store:
+    """
+    Handoffs database. Holds the handoff manifests and the articles and images already localized in each locale.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the SQLite database file. Created if it doesn't exist
+        """
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def is_empty(self):
+        """
+        :return: True if the database has no handoffs and no localized content, such as when it was just created
+        """
+        with self.lock:
+            for table in ('handoffs', 'localized_articles', 'localized_images'):
+                if self.connection.execute('SELECT 1 FROM {} LIMIT 1'.format(table)).fetchone() is not None:
+                    return False
+        return True
+
+    def save_handoff(self, name, articles, status='in progress'):
+        """
+        Adds a handoff and its manifest, replacing any handoff with the same name.
+        :param name: Handoff name
+        :param articles: List of article dicts with the keys in MANIFEST_FIELDS
+        :param status: Handoff status
+        :return: None
+        """
+        rows = [(name, position) + tuple(article[field] for field in MANIFEST_FIELDS)
+                for position, article in enumerate(articles)]
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO handoffs (name, status) VALUES (?, ?)', (name, status))
+            self.connection.execute('DELETE FROM manifest WHERE handoff = ?', (name,))
+            self.connection.executemany('INSERT INTO manifest (handoff, position, {}) VALUES (?, ?{})'.format(
+                ', '.join(MANIFEST_FIELDS), ', ?' * len(MANIFEST_FIELDS)), rows)
+
+    def get_handoff_manifest(self, name):
+        """
+        Gets the articles in a handoff, in the order they were loaded.
+        :param name: Handoff name
+        :return: List of article dicts, or None if the handoff doesn't exist
+        """
+        with self.lock:
+            if self.connection.execute('SELECT 1 FROM handoffs WHERE name = ?', (name,)).fetchone() is None:
+                return None
+            rows = self.connection.execute('SELECT {} FROM manifest WHERE handoff = ? ORDER BY position'.format(
+                ', '.join(MANIFEST_FIELDS)), (name,)).fetchall()
+        articles = []
+        for row in rows:
+            article = dict(zip(MANIFEST_FIELDS, row))
+            article['en_images'] = bool(article['en_images'])
+            article['bump_ok'] = bool(article['bump_ok'])
+            articles.append(article)
+        return articles
+
+    def get_handoff_names(self):
+        """
+        :return: List of the names of the handoffs in the database, sorted
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT name FROM handoffs ORDER BY name').fetchall()
+        return [row[0] for row in rows]
+
+    def add_localized_content(self, articles=(), images=()):
+        """
+        Registers articles and images as localized, in one transaction.
+        :param articles: Iterable of (locale, article_id) tuples
+        :param images: Iterable of (locale, image_name) tuples
+        :return: Number of articles and images that weren't registered before
+        """
+        with self.lock, self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany('INSERT OR IGNORE INTO localized_articles (locale, article_id) VALUES (?, ?)',
+                                        [(locale, int(article_id)) for locale, article_id in articles])
+            self.connection.executemany('INSERT OR IGNORE INTO localized_images (locale, name) VALUES (?, ?)',
+                                        list(images))
+            return self.connection.total_changes - before
+
+    def get_localized_articles(self, locale):
+        """
+        :param locale: Help Center locale, such as 'de' or 'pt-br'
+        :return: Set of the ids of the articles localized in the locale
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT article_id FROM localized_articles WHERE locale = ?',
+                                           (locale,)).fetchall()
+        return {row[0] for row in rows}
+
+    def get_localized_images(self, locale):
+        """
+        :param locale: Help Center locale, such as 'de' or 'pt-br'
+        :return: Set of the names of the images localized in the locale
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT name FROM localized_images WHERE locale = ?',
+                                           (locale,)).fetchall()
+        return {row[0] for row in rows}
+
+    def save_ledger(self, handoff, entries):
+        """
+        Records the content sent in a handoff, replacing any earlier record of the handoff.
+        :param handoff: Handoff name
+        :param entries: Iterable of (kind, hc, name, hash) tuples. kind is 'article' or 'image'
+        :return: None
+        """
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM ledger WHERE handoff = ?', (handoff,))
+            self.connection.executemany('INSERT OR REPLACE INTO ledger (handoff, kind, hc, name, hash) '
+                                        'VALUES (?, ?, ?, ?, ?)', [(handoff,) + tuple(entry) for entry in entries])
+
+    def get_sent_hashes(self, kind, exclude=None):
+        """
+        Gets the hash of each article or image as it was last sent in a handoff.
+        :param kind: 'article' or 'image'
+        :param exclude: Name of a handoff to leave out, such as the one being created. Optional
+        :return: Dict of {(hc, name): hash}
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT hc, name, hash FROM ledger WHERE kind = ? AND handoff IS NOT ? '
+                                           'ORDER BY rowid', (kind, exclude)).fetchall()
+        return {(hc, name): content_hash for hc, name, content_hash in rows}
+
+    def save_translation_hash(self, hc, article_id, locale, translation_hash):
+        """
+        Records the hash of a translation published to Help Center, replacing the hash of the previous one.
+        :param hc: Help Center subdomain
+        :param article_id: Article id
+        :param locale: Locale of the translation
+        :param translation_hash: Hash returned by get_translation_hash() in modules.handoff
+        :return: None
+        """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO translations (hc, article_id, locale, hash) '
+                                    'VALUES (?, ?, ?, ?)', (hc, int(article_id), locale, translation_hash))
+
+    def get_translation_hashes(self):
+        """
+        :return: Dict of {(hc, article_id, locale): hash} of the translations last published
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT hc, article_id, locale, hash FROM translations').fetchall()
+        return {(hc, article_id, locale): translation_hash for hc, article_id, locale, translation_hash in rows}
+
+    def get_localized_locales(self):
+        """
+        Gets every localized article and image with the locales it's localized in.
+        :return: Tuple of two dicts: {article_id: set of locales} and {image_name: set of locales}
+        """
+        with self.lock:
+            article_rows = self.connection.execute('SELECT article_id, locale FROM localized_articles').fetchall()
+            image_rows = self.connection.execute('SELECT name, locale FROM localized_images').fetchall()
+        articles = {}
+        for article_id, locale in article_rows:
+            articles.setdefault(article_id, set()).add(locale)
+        images = {}
+        for name, locale in image_rows:
+            images.setdefault(name, set()).add(locale)
+        return articles, images
+
+
+def migrate_json_files(store, data_path):
+    """
+    Copies handoffs.json and localized_content.json into the store. Safe to run more than once.
+    :param store: Store object
+    :param data_path: Path of the data folder containing the JSON files
+    :return: None
+    """
+    handoffs_file = data_path / 'handoffs.json'
+    if handoffs_file.exists():
+        handoffs = helpers.read_json(handoffs_file)
+        for name, handoff in handoffs.items():
+            articles = [{field: article.get(field) for field in MANIFEST_FIELDS} for article in handoff['articles']]
+            store.save_handoff(name, articles, handoff.get('status'))
+        print('- migrated {} handoffs'.format(len(handoffs)))
+
+    localized_file = data_path / 'localized_content.json'
+    if localized_file.exists():
+        localized_content = helpers.read_json(localized_file)
+        if isinstance(localized_content, dict):     # {locale: {'articles': [], 'images': []}}
+            entries = [(locale, content.get('articles', []), content.get('images', []))
+                       for locale, content in localized_content.items()]
+        else:                                       # [{'Locale': locale, 'Articles': [], 'Images': []}]
+            entries = [(item['Locale'], item.get('Articles', []), item.get('Images', []))
+                       for item in localized_content]
+        added = 0
+        for locale, article_ids, image_names in entries:
+            added += store.add_localized_content([(locale, article_id) for article_id in article_ids],
+                                                 [(locale, name) for name in image_names])
+        print('- migrated {} localized articles and images'.format(added))
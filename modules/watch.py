@@ -0,0 +1,146 @@
+import time
+
+import modules.handoff as ho
+from modules.metrics import get_metrics
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:     # not installed, or not Linux: poll the folder instead
+    INotify = None
+
+
+class FolderWatcher:
+    """
+    Waits for changes in a folder and its subfolders. Uses inotify if the inotify_simple package is installed,
+    otherwise checks the folder at regular intervals.
+    """
+
+    def __init__(self, path, interval):
+        """
+        :param path: Path of the folder to watch
+        :param interval: Maximum number of seconds to wait for a change
+        """
+        self.path = path
+        self.interval = interval
+        self.inotify = None
+        self.watched = set()
+        if INotify is not None:
+            try:
+                self.inotify = INotify()
+            except OSError:     # inotify not available, or out of instances
+                self.inotify = None
+        if self.inotify is not None:
+            self.add_watches()
+
+    def add_watches(self):
+        """
+        Watches the folders not watched yet, such as the locale folders copied since the last call.
+        :return: None
+        """
+        mask = flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE | flags.DELETE | flags.MOVED_TO | flags.MOVED_FROM
+        for folder in [self.path] + sorted(path for path in self.path.rglob('*') if path.is_dir()):
+            if folder in self.watched:
+                continue
+            try:
+                self.inotify.add_watch(str(folder), mask)
+                self.watched.add(folder)
+            except OSError:     # removed since it was listed
+                pass
+
+    def wait(self):
+        """
+        Returns after a change in the folder, or after the interval.
+        :return: None
+        """
+        if self.inotify is None:
+            time.sleep(self.interval)
+            return
+        if self.inotify.read(timeout=int(self.interval * 1000)):
+            self.add_watches()
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+def get_folder_state(path):
+    """
+    :param path: Path of a folder
+    :return: Frozenset of the relative path, size, and modification time of each file in the folder and its subfolders
+    """
+    state = set()
+    for file_path in path.rglob('*'):
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:   # removed since it was listed
+            continue
+        if file_path.is_file():
+            state.add((str(file_path.relative_to(path)), stat.st_size, stat.st_mtime_ns))
+    return frozenset(state)
+
+
+def watch_deliverable(delivery_path, settle, interval, workers=None, verify_live=False):
+    """
+    Publishes the locale folders of a deliverable as the vendor delivers them. A locale folder is published once no
+    file in it has changed for settle seconds, and again if it changes after that. A locale folder that fails to
+    publish is published again at the next check. Runs until stopped with Ctrl+C.
+    The connections, S3 listings, and localized content read by the first publish are reused by the next ones.
+    :param delivery_path: Path of the translations folder of the handoff
+    :param settle: Number of seconds a locale folder must stay unchanged before it's published
+    :param interval: Maximum number of seconds between checks of the folder
+    :param workers: Number of processes preparing articles. Optional. Default is parse_workers in settings.ini
+    :param verify_live: If True, compares each translation with the live one in Help Center
+    :return: None
+    """
+    states = {}         # {locale folder name: (state, time of the last change)}
+    published = {}      # {locale folder name: state when last published}
+    watcher = FolderWatcher(delivery_path, min(interval, settle))
+    print('\nWatching {} {}. Press Ctrl+C to stop.'.format(delivery_path, 'with inotify' if watcher.inotify
+                                                           else 'every {} seconds'.format(watcher.interval)))
+    try:
+        while True:
+            now = time.monotonic()
+            for locale_path in sorted(path for path in delivery_path.iterdir() if path.is_dir()):
+                state = get_folder_state(locale_path)
+                if locale_path.name not in states or states[locale_path.name][0] != state:
+                    states[locale_path.name] = (state, now)
+                    continue
+                if state and state != published.get(locale_path.name) and now - states[locale_path.name][1] >= settle:
+                    try:
+                        publish_locale(delivery_path, locale_path.name, workers, verify_live)
+                    except (Exception, SystemExit) as error:    # exit() on a failed request, among others
+                        reason = 'exited' if isinstance(error, SystemExit) else repr(error)
+                        print('\nCould not publish {} ({}). Trying again at the next check.'.format(locale_path.name,
+                                                                                                  reason))
+                        continue
+                    published[locale_path.name] = state
+            watcher.wait()
+    except KeyboardInterrupt:
+        print('\nStopped watching {}\n'.format(delivery_path))
+    finally:
+        watcher.close()
+
+
+def publish_locale(delivery_path, locale_folder, workers=None, verify_live=False):
+    """
+    Publishes the articles and images of one locale folder of a deliverable. Content already published from the
+    deliverable is skipped with the publish journal.
+    :param delivery_path: Path of the translations folder of the handoff
+    :param locale_folder: Name of the locale folder, such as 'de' or 'PT-BR'
+    :param workers: Number of processes preparing articles. Optional. Default is parse_workers in settings.ini
+    :param verify_live: If True, compares each translation with the live one in Help Center
+    :return: None
+    """
+    locale = locale_folder.lower()
+    print('\n=== {} {} ==='.format(locale, time.strftime('%H:%M:%S')))
+    metrics = get_metrics()
+    with metrics.stage('deliverable'):
+        deliverable = ho.get_deliverable(delivery_path)
+        deliverable['articles'] = [article for article in deliverable['articles'] if article['locale'] == locale]
+        deliverable['images'] = [image for image in deliverable['images'] if image['locale'] == locale]
+    with metrics.stage('upload'):
+        ho.publish_deliverable(deliverable, workers, resume=True, verify_live=verify_live)
+    with metrics.stage('register'):
+        ho.register_new_localized_content(deliverable)
+    print('\nPublished {} {} articles'.format(len(deliverable['published']), locale))
+    ho.print_bad_links(deliverable)
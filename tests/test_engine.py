@@ -0,0 +1,65 @@
+"""
+Checks that the lxml engine writes the same markup as the BeautifulSoup engine.
+
+    $ python3 -m pytest tests
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from modules.engine import SoupEngine, LxmlEngine     # noqa: E402
+
+# Article files as the vendor returns them
+FILES = [
+    '<html><head><meta charset="utf-8"></head><body><h1>Title</h1><p>Text</p></body></html>',
+    '<!DOCTYPE html>\n<html><head><meta charset="utf-8"></head><body><h1>Title</h1><p>Text</p></body></html>\n',
+    '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" '
+    '"http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">\n<html xmlns="http://www.w3.org/1999/xhtml"><head>'
+    '<meta http-equiv="Content-Type" content="text/html; charset=utf-8" /></head><body><h1>Titel</h1>'
+    '<p>Ein <a href="/hc/en-us/articles/203661526">Link</a></p></body></html>',
+    '<!-- exported --><!DOCTYPE html><html><body><h1>Title</h1></body></html>',
+    '<!DOCTYPE html><!-- exported --><html><body><h1>Title</h1></body></html>',
+    '<!-- a --><!DOCTYPE html><!-- b --><html><body><h1>Title</h1></body></html>',
+    '<html><body><h1>Title</h1></body></html>\n<!-- trailer -->\n',
+    '<p>a</p></body></html><p>after</p>',
+    '<html><body><h1>T&amp;C</h1><p>1 &lt; 2 &gt; 0 &nbsp; café &#169;</p></body></html>',
+    '<html><body><h1>Title</h1><pre>  keep\n    this  </pre><textarea>\n two </textarea></body></html>',
+    '<html><body><h1>Title</h1><script>if (a < b && c > d) {}</script><style>p > a {}</style></body></html>',
+    '<html><body><h1>Title</h1><p class="one  two" data-x=\'"q"\'>x<br>y<img src="a.png" alt=""></p></body></html>',
+    '<html><body><h1>Title</h1><table><tr><td nowrap>cell</td></tr></table></body></html>',
+    '<html><body><h1>Title</h1><ul><li>one<li>two</ul><p>unclosed<div>block</div></body></html>',
+    '<html><body><h1>  Spaced   <em>title</em> </h1><p>   many     spaces   </p>\n\n\n<p>next</p></body></html>',
+]
+
+# Article bodies as the Help Center API returns them
+BODIES = [
+    '<p>Text</p>',
+    '<p>See <a href="/hc/en-us/articles/203661526#topic_1">this</a>.</p><!-- note --><p>More</p>',
+    '<p> </p>',
+    '<h2>Heading</h2><pre><!-- kept --> code</pre><img src="https://example.com/docs/en/a.png">',
+    '<ol><li><input type="checkbox" checked> done</li></ol>',
+]
+
+
+@pytest.mark.parametrize('markup', FILES)
+def test_parse_file(tmp_path, markup):
+    path = tmp_path / 'article.html'
+    path.write_text(markup, encoding='utf-8')
+    soup, lxml = SoupEngine(), LxmlEngine()
+    soup_tree, lxml_tree = soup.parse_file(path), lxml.parse_file(path)
+    assert lxml.serialize(lxml_tree) == soup.serialize(soup_tree)
+    assert lxml.pop_title(lxml_tree) == soup.pop_title(soup_tree)
+    assert lxml.serialize(lxml_tree) == soup.serialize(soup_tree)
+
+
+@pytest.mark.parametrize('body', BODIES)
+def test_parse_article(body):
+    soup, lxml = SoupEngine(), LxmlEngine()
+    soup_tree, lxml_tree = soup.parse_article(body, 'Title'), lxml.parse_article(body, 'Title')
+    if soup_tree is None:
+        assert lxml_tree is None
+        return
+    assert lxml.serialize(lxml_tree) == soup.serialize(soup_tree)
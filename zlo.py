@@ -1,80 +1,278 @@
 import argparse
 
-import modules.handoff as ho
-from modules.helpers import get_path_setting
+from modules.metrics import get_metrics
+
+# Each subcommand imports the modules it uses when it runs, so commands such as load don't wait for boto3 or the
+# HTML parsers to load
 
 
 def load(arguments):
     """
-    Loads data from the _loader.csv file to the handoffs.json file, the main handoffs database.
+    Loads data from the _loader.csv file to the handoffs database.
     This is temporary until the website and db are up.
     :param arguments: handoff_name (str)
     :return: None
     """
-    ho.load_handoff_data(arguments.handoff_name, arguments.custom)
+    import modules.handoff as ho
+
+    with get_metrics().stage('load'):
+        ho.load_handoff_data(arguments.handoff_name, arguments.custom)
+
+
+def migrate(arguments):
+    """
+    Copies the handoffs.json and localized_content.json files into the handoffs database. Only needed once.
+    :param arguments: None
+    :return: None
+    """
+    from modules.helpers import get_path_setting
+    from modules.store import Store, migrate_json_files
 
+    print('\nMigrating the JSON data files to the handoffs database')
+    data_path = get_path_setting('data')
+    migrate_json_files(Store(data_path / 'zlo.db'), data_path)
+    print('\nProcess done\n')
 
-def create(arguments):
+
+def create(arguments, handed_off=None):
     """
     Creates a handoff package in the handoffs folder specified in settings.ini.
     :param arguments: handoff_name (str)
+    :param handed_off: Set of (hc, article_id) of the articles in the earlier handoffs of a batch. Optional. If
+    specified, those articles are left out and the articles of this handoff are added to the set
     :return: None
     """
+    import modules.handoff as ho
+    from modules.helpers import get_path_setting, get_setting, get_aws_setting
+    from modules.context import get_context
+    from modules.package import HandoffPackage
+
     handoff_path = get_path_setting('handoffs') / arguments.handoff_name
     if handoff_path.exists():
         print('A handoff with that name already exists in the handoffs folder. Exiting.')
         exit()
+    metrics = get_metrics()
     handoff_manifest = ho.get_handoff_manifest(arguments.handoff_name)
-    handoff = ho.download_articles(handoff_manifest)
-    ho.write_articles(handoff, handoff_path)
-    ho.download_images(handoff, handoff_path)
+    if handed_off is not None:
+        handoff_manifest = ho.remove_handed_off(handoff_manifest, handed_off)
+    with metrics.stage('download'):
+        handoff = ho.download_articles(handoff_manifest, arguments.workers)
+    store = get_context().store
+    article_hashes = store.get_sent_hashes('article', arguments.handoff_name) if arguments.delta else None
+    image_hashes = store.get_sent_hashes('image', arguments.handoff_name) if arguments.delta else None
+    package = None
+    if arguments.package:
+        package = HandoffPackage(handoff_path.parent / '{}.zip'.format(arguments.handoff_name),
+                                 int(get_setting('PACKAGE', 'compress_workers')))
+    with metrics.stage('write'):
+        ho.write_articles(handoff, handoff_path, article_hashes, package)
+    with metrics.stage('images'):
+        locales = arguments.locales or [locale.strip() for locale in get_aws_setting('locales').split(',')]
+        ho.download_images(handoff, handoff_path, [locale.lower() for locale in locales], image_hashes, package)
+    if package is not None:
+        with metrics.stage('package'):
+            package.close()
+        print('\nPackaged the handoff in {}'.format(package.path))
+    ho.save_ledger(handoff, arguments.handoff_name)
     ho.print_handoff_email(arguments.handoff_name)
     print('\nProcess done\n')
 
 
-def publish(arguments):
+def publish(arguments, deliverable=None):
     """
     Publishes the articles and images of a handoff deliverable to Help Centers and Amazon S3 respectively.
     :param arguments: handoff_name(str)
+    :param deliverable: Dict returned by get_deliverable(). Optional. Used by batch, which gets the deliverables of
+    every handoff first
     :return:
     """
-    delivery_path = get_path_setting('handoffs') / arguments.handoff_name / 'translations'
-    if not delivery_path.exists():
-        print('Folder does not exist: {}. Exiting.'.format(delivery_path))
-        exit()
-    deliverable = ho.get_deliverable(delivery_path, arguments.defer, arguments.subset)
-    ho.register_new_localized_content(deliverable)
-    ho.relink_articles(deliverable)
-    ho.upload_images(deliverable)
-    ho.upload_articles(deliverable)
+    import modules.handoff as ho
+    from modules.helpers import get_path_setting
+
+    metrics = get_metrics()
+    if deliverable is None:
+        delivery_path = get_path_setting('handoffs') / arguments.handoff_name / 'translations'
+        if not delivery_path.exists():
+            print('Folder does not exist: {}. Exiting.'.format(delivery_path))
+            exit()
+        with metrics.stage('deliverable'):
+            deliverable = ho.get_deliverable(delivery_path, arguments.defer, arguments.subset)
+    with metrics.stage('upload'):
+        ho.publish_deliverable(deliverable, arguments.workers, arguments.resume, arguments.verify_live)
+    with metrics.stage('register'):
+        ho.register_new_localized_content(deliverable)
     ho.print_publish_email(deliverable, arguments.handoff_name)
+    ho.print_bad_links(deliverable)
     print('\nProcess done\n')
 
 
+def batch(arguments):
+    """
+    Creates or publishes several handoffs in one run. The handoffs share the HTTP connections, the S3 bucket and its
+    listings, the image cache, and the handoffs database. An article in several of the handoffs is only handed off
+    in the first one, and only its translation in the last deliverable is published. The images of every deliverable
+    are uploaded with the first one, before the articles that use them.
+    :param arguments: command ('create' or 'publish'), handoff_names (list), start and end (str)
+    :return: None
+    """
+    import modules.handoff as ho
+    from modules.helpers import get_path_setting
+    from modules.context import get_context
+
+    handoffs_path = get_path_setting('handoffs')
+    if arguments.command == 'create':
+        available = get_context().store.get_handoff_names()
+    else:
+        available = sorted(path.parent.name for path in handoffs_path.glob('*/translations') if path.is_dir())
+    handoff_names = []
+    for handoff_name in ho.get_batch_names(arguments.handoff_names, arguments.start, arguments.end, available):
+        if handoff_name in available:
+            handoff_names.append(handoff_name)
+        elif arguments.command == 'create':
+            print('No handoff named {} in the handoffs database. Skipping.'.format(handoff_name))
+        else:
+            print('Folder does not exist: {}. Skipping.'.format(handoffs_path / handoff_name / 'translations'))
+    if not handoff_names:
+        print('No handoffs to {}. Exiting.'.format(arguments.command))
+        exit()
+    print('\nHandoffs to {}: {}'.format(arguments.command, ', '.join(handoff_names)))
+
+    if arguments.command == 'create':
+        handed_off = set()
+        for handoff_name in handoff_names:
+            if (handoffs_path / handoff_name).exists():
+                print('\nThe {} handoff folder already exists. Skipping.'.format(handoff_name))
+                continue
+            print('\n=== {} ==='.format(handoff_name))
+            create(argparse.Namespace(**vars(arguments), handoff_name=handoff_name), handed_off)
+    else:
+        with get_metrics().stage('deliverable'):
+            deliverables = [ho.get_deliverable(handoffs_path / handoff_name / 'translations')
+                            for handoff_name in handoff_names]
+            ho.dedupe_deliverables(deliverables)
+        for handoff_name, deliverable in zip(handoff_names, deliverables):
+            print('\n=== {} ==='.format(handoff_name))
+            publish(argparse.Namespace(**vars(arguments), handoff_name=handoff_name), deliverable)
+
+
+def watch(arguments):
+    """
+    Publishes the locale folders of a handoff deliverable as they're delivered, until stopped with Ctrl+C.
+    :param arguments: handoff_name (str)
+    :return: None
+    """
+    from modules.helpers import get_path_setting, get_setting
+    from modules.watch import watch_deliverable
+
+    handoff_path = get_path_setting('handoffs') / arguments.handoff_name
+    if not handoff_path.exists():
+        print('Folder does not exist: {}. Exiting.'.format(handoff_path))
+        exit()
+    delivery_path = handoff_path / 'translations'
+    delivery_path.mkdir(exist_ok=True)
+    settle = arguments.settle if arguments.settle is not None else int(get_setting('WATCH', 'settle_seconds'))
+    watch_deliverable(delivery_path, settle, int(get_setting('WATCH', 'poll_seconds')), arguments.workers,
+                      arguments.verify_live)
+
+
+def write_metrics_report(arguments):
+    """
+    Writes the metrics of the run to the handoff folder, or to the data folder if the handoff has no folder yet or
+    the run is a batch.
+    :param arguments: handoff_name (str)
+    :return: None
+    """
+    from modules.helpers import get_path_setting
+
+    folder = get_path_setting('handoffs') / getattr(arguments, 'handoff_name', '')
+    if not getattr(arguments, 'handoff_name', None) or not folder.exists():
+        folder = get_path_setting('data')
+    path = get_metrics().write_report(folder, arguments.func.__name__)
+    print('Metrics written to {}\n'.format(path))
+
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--version', action='version', version='1.0.0')
 subparsers = parser.add_subparsers()
 
-# python3 zlo.py load {handoff_name} --custom
+# python3 zlo.py load {handoff_name} --custom --metrics
 load_parser = subparsers.add_parser('load')
 load_parser.add_argument('handoff_name', help='handoff name, usually yyyy-mm-dd')
 load_parser.add_argument('--custom', action='store_true', help='Flag for custom data source')
+load_parser.add_argument('--metrics', action='store_true', help='write a timing and request report')
 load_parser.set_defaults(func=load)
 
-# python3 zlo.py create {handoff_name}
+# python3 zlo.py migrate
+migrate_parser = subparsers.add_parser('migrate')
+migrate_parser.set_defaults(func=migrate)
+
+# python3 zlo.py create {handoff_name} --workers {n} --locales {locale locale ...} --delta --package --metrics
 create_parser = subparsers.add_parser('create')
 create_parser.add_argument('handoff_name', help='handoff name, usually yyyy-mm-dd')
+create_parser.add_argument('--workers', type=int,
+                           help='number of concurrent article downloads (default is download_workers in settings.ini)')
+create_parser.add_argument('--locales', nargs='*',
+                           help='locales the handoff is translated into (default is locales in settings.ini)')
+create_parser.add_argument('--delta', action='store_true',
+                           help='leave out the articles and images unchanged since they were last sent')
+create_parser.add_argument('--package', action='store_true',
+                           help='also write the handoff to {handoff_name}.zip in the handoffs folder')
+create_parser.add_argument('--metrics', action='store_true', help='write a timing and request report')
 create_parser.set_defaults(func=create)
 
-# python3 zlo.py publish {handoff_name} --defer {id id ...} --subset {id id ...}
+# python3 zlo.py publish {handoff_name} --defer {id id ...} --subset {id id ...} --workers {n} --resume --verify-live
+#     --metrics
 publish_parser = subparsers.add_parser('publish')
 publish_parser.add_argument('handoff_name', help='handoff name, usually yyyy-mm-dd')
 publish_parser.add_argument('--defer', nargs='*', type=int,
                             help='ids of articles to publish later')
 publish_parser.add_argument('--subset', nargs='*', type=int,
                             help='ids of articles to publish (default is all)')
+publish_parser.add_argument('--workers', type=int,
+                            help='number of processes parsing articles (default is parse_workers in settings.ini)')
+publish_parser.add_argument('--resume', action='store_true',
+                            help='skip the images and articles uploaded by an earlier run that stopped partway')
+publish_parser.add_argument('--verify-live', action='store_true',
+                            help='compare each translation with the live one instead of the last one published')
+publish_parser.add_argument('--metrics', action='store_true', help='write a timing and request report')
 publish_parser.set_defaults(func=publish)
 
+# python3 zlo.py watch {handoff_name} --settle {seconds} --workers {n} --verify-live --metrics
+watch_parser = subparsers.add_parser('watch')
+watch_parser.add_argument('handoff_name', help='handoff name, usually yyyy-mm-dd')
+watch_parser.add_argument('--settle', type=int,
+                          help='seconds a locale folder must stay unchanged before it\'s published '
+                               '(default is settle_seconds in settings.ini)')
+watch_parser.add_argument('--workers', type=int,
+                          help='number of processes parsing articles (default is parse_workers in settings.ini)')
+watch_parser.add_argument('--verify-live', action='store_true',
+                          help='compare each translation with the live one instead of the last one published')
+watch_parser.add_argument('--metrics', action='store_true', help='write a timing and request report')
+watch_parser.set_defaults(func=watch)
+
+# python3 zlo.py batch {create|publish} {handoff_name handoff_name ...} --from {yyyy-mm-dd} --to {yyyy-mm-dd} ...
+batch_parser = subparsers.add_parser('batch')
+batch_parser.add_argument('command', choices=['create', 'publish'], help='command to run on each handoff')
+batch_parser.add_argument('handoff_names', nargs='*', help='handoff names, in the order to process them')
+batch_parser.add_argument('--from', dest='start',
+                          help='also process the handoffs named yyyy-mm-dd from this date, in date order')
+batch_parser.add_argument('--to', dest='end', help='last date of the --from range (default is the last handoff)')
+batch_parser.add_argument('--workers', type=int, help='see the workers option of the create or publish command')
+batch_parser.add_argument('--locales', nargs='*', help='see the locales option of the create command')
+batch_parser.add_argument('--delta', action='store_true', help='see the delta option of the create command')
+batch_parser.add_argument('--package', action='store_true', help='see the package option of the create command')
+batch_parser.add_argument('--resume', action='store_true', help='see the resume option of the publish command')
+batch_parser.add_argument('--verify-live', action='store_true',
+                          help='see the verify-live option of the publish command')
+batch_parser.add_argument('--metrics', action='store_true', help='write a timing and request report')
+batch_parser.set_defaults(func=batch, defer=None, subset=None)
+
 if __name__ == '__main__':      # do NOT comment out - required to call functions
     args = parser.parse_args()
-    args.func(args)             # call the default function
+    if getattr(args, 'metrics', False):
+        get_metrics().enable()
+    try:
+        args.func(args)         # call the default function
+    finally:
+        if getattr(args, 'metrics', False):
+            write_metrics_report(args)